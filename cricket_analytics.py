@@ -89,10 +89,8 @@ def cricket_analytics(players, client):
             if r["Player"]
         ]
 
-        duplicates = [
-            p for p in used
-            if used.count(p) > 1
-        ]
+        counts = pd.Series(used, dtype=object).value_counts()
+        duplicates = counts[counts > 1].index.tolist()
 
         if duplicates:
             st.error(
@@ -1,68 +1,106 @@
 # fair_vehicle_selector_app.py
 
 import streamlit as st
+import heapq
 import json
 import os
 
+# Optional fast JSON backend
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 HISTORY_FILE = "vehicle_history.json"
 
 
 # -----------------------------
 # Utility Functions
 # -----------------------------
+def json_loads(raw):
+    return orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+
+
+def json_dumps(obj):
+    """Serialize to compact UTF-8 JSON bytes"""
+    return orjson.dumps(obj) if ORJSON_AVAILABLE else json.dumps(obj).encode("utf-8")
+
+
+@st.cache_data(show_spinner=False)
+def _load_cached(mtime):
+    """Parse the history file; cached until its modification time changes"""
+    with open(HISTORY_FILE, "rb") as f:
+        return json_loads(f.read())
+
+
 def load_history():
     if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            data = json.load(f)
+        data = _load_cached(os.path.getmtime(HISTORY_FILE))
         return data.get("history", {}), data.get("last_index", -1), data.get("vehicle_set", [])
     else:
         return {}, -1, []
 
 
 def save_history(history, last_index, vehicle_set):
-    with open(HISTORY_FILE, "w") as f:
-        json.dump({
+    # Skip the write when nothing changed since this session last saved
+    h = hash((tuple(history.items()), last_index, tuple(vehicle_set)))
+    if st.session_state.get("_state_hash") == h and os.path.exists(HISTORY_FILE):
+        return
+    # Write to a temp file and swap it in so readers never see a partial file
+    tmp = HISTORY_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(json_dumps({
             "history": history,
             "last_index": last_index,
             "vehicle_set": vehicle_set
-        }, f, indent=4)
+        }))
+    os.replace(tmp, HISTORY_FILE)
+    _load_cached.clear()
+    st.session_state._state_hash = h
+
+
+def flush():
+    """Write the session's in-memory state back to the history file"""
+    save_history(st.session_state.history, st.session_state.last_index, st.session_state.vehicle_set)
 
 
-def select_vehicles(vehicle_set, player_set, num_needed):
-    history, last_index, old_vehicle_set = load_history()
+@st.cache_data(show_spinner=False)
+def sorted_table(history_items):
+    """Usage table ordered by count, rebuilt only when the counts change"""
+    return dict(sorted(history_items, key=lambda x: x[1]))
 
+
+def select_vehicles(history, last_index, vehicle_set, player_set, num_needed):
     # Add new vehicles if not seen before
     for v in vehicle_set:
         if v not in history:
             history[v] = 0
 
     # Remove old ones if deleted
-    for old_v in list(history.keys()):
-        if old_v not in vehicle_set:
+    vehicle_lookup = set(vehicle_set)
+    for old_v in list(history):
+        if old_v not in vehicle_lookup:
             del history[old_v]
 
     # Filter eligible
-    eligible = [v for v in vehicle_set if v in player_set]
+    player_lookup = set(player_set)
+    eligible = [v for v in vehicle_set if v in player_lookup]
     if not eligible:
         return [], history, last_index
 
     # Fair round robin sorting
-    ordered = sorted(
-        eligible,
-        key=lambda v: (
-            history.get(v, 0),
-            (vehicle_set.index(v) - last_index) % len(vehicle_set)
-        )
-    )
-
-    selected = ordered[:num_needed]
+    pos = {v: i for i, v in enumerate(vehicle_set)}
+    n = len(vehicle_set)
+    keyed = [(history[v], (pos[v] - last_index) % n, v) for v in eligible]
+    selected = [t[-1] for t in heapq.nsmallest(num_needed, keyed)]
 
     # Update history
     for v in selected:
-        history[v] = history.get(v, 0) + 1
+        history[v] += 1
 
     if selected:
-        last_index = vehicle_set.index(selected[-1])
+        last_index = pos[selected[-1]]
 
     save_history(history, last_index, vehicle_set)
 
@@ -77,8 +115,12 @@ st.set_page_config(page_title="Fair Vehicle Selector", page_icon="🚗", layout=
 st.title("🚗 Fair Vehicle Selector")
 st.write("A simple round-robin algorithm to select vehicles fairly based on attendance and past usage.")
 
-# Load previous state
-history, last_index, vehicle_set = load_history()
+# Load previous state once per session; reruns work from memory
+if "history" not in st.session_state:
+    st.session_state.history, st.session_state.last_index, st.session_state.vehicle_set = load_history()
+history = st.session_state.history
+last_index = st.session_state.last_index
+vehicle_set = st.session_state.vehicle_set
 
 # --- Section 1: Manage Vehicle Set ---
 st.header("1️⃣ Manage Vehicle Set")
@@ -87,7 +129,7 @@ if st.button("Add Vehicle"):
     if new_vehicle and new_vehicle not in vehicle_set:
         vehicle_set.append(new_vehicle)
         history[new_vehicle] = 0
-        save_history(history, last_index, vehicle_set)
+        flush()
         st.success(f"✅ Added new vehicle owner: {new_vehicle}")
     elif new_vehicle in vehicle_set:
         st.warning("⚠️ This vehicle owner already exists.")
@@ -100,7 +142,7 @@ if vehicle_set:
         vehicle_set.remove(remove_vehicle)
         if remove_vehicle in history:
             del history[remove_vehicle]
-        save_history(history, last_index, vehicle_set)
+        flush()
         st.success(f"🗑️ Removed {remove_vehicle} from the vehicle set.")
 
 st.subheader("Current Vehicle Set:")
@@ -111,11 +153,15 @@ st.header("2️⃣ Daily Selection")
 if not vehicle_set:
     st.warning("Please add at least one vehicle owner before selecting.")
 else:
-    players_today = st.multiselect("Select players present today:", vehicle_set)
-    num_needed = st.number_input("Number of vehicles needed:", min_value=1, max_value=len(vehicle_set), value=1)
-
-    if st.button("Select Vehicles"):
-        selected, history, last_index = select_vehicles(vehicle_set, players_today, num_needed)
+    # Batch the inputs in a form so editing them doesn't rerun the whole script
+    with st.form("selection_form"):
+        players_today = st.multiselect("Select players present today:", vehicle_set)
+        num_needed = st.number_input("Number of vehicles needed:", min_value=1, max_value=len(vehicle_set), value=1)
+        submitted = st.form_submit_button("Select Vehicles")
+
+    if submitted:
+        selected, history, last_index = select_vehicles(history, last_index, vehicle_set, players_today, num_needed)
+        st.session_state.history, st.session_state.last_index = history, last_index
         if not selected:
             st.warning("⚠️ No eligible vehicle owners available today.")
         else:
@@ -125,7 +171,7 @@ else:
 # --- Section 3: History Overview ---
 st.header("3️⃣ Usage History")
 if history:
-    sorted_history = dict(sorted(history.items(), key=lambda x: x[1]))
+    sorted_history = sorted_table(tuple(history.items()))
     st.table(sorted_history)
 else:
     st.info("No history yet. Start by adding vehicles and making selections.")
@@ -1,11 +1,25 @@
 import streamlit as st
+import csv
+import functools
+import heapq
+import io
 import json
 import os
+from collections import deque
 from datetime import date
+import numpy as np
 import pandas as pd
 import plotly.express as px
 
+# Optional fast JSON backend
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 HISTORY_FILE = "vehicle_history.json"
+RECORDS_FILE = "vehicle_records.jsonl"
 BACKUP_FILE = "vehicle_history_backup.csv"
 
 # -----------------------------
@@ -16,85 +30,192 @@ DEFAULT_VEHICLES = ["Alice", "Bob", "Charlie", "David"]
 # -----------------------------
 # Utility Functions
 # -----------------------------
+def json_loads(raw):
+    return orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+
+def json_dumps(obj):
+    """Serialize to compact UTF-8 JSON bytes"""
+    return orjson.dumps(obj) if ORJSON_AVAILABLE else json.dumps(obj).encode("utf-8")
+
+@st.cache_data(show_spinner=False)
+def _load_cached(mtime):
+    """Parse the history file; cached until its modification time changes"""
+    with open(HISTORY_FILE, "rb") as f:
+        return json_loads(f.read())
+
 def load_history():
     if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
-            data = json.load(f)
+        data = _load_cached(os.path.getmtime(HISTORY_FILE))
+        # Older history files kept the game records inline; move them to the log
+        legacy_records = data.get("records")
+        if legacy_records and not os.path.exists(RECORDS_FILE):
+            with open(RECORDS_FILE, "wb") as f:
+                f.writelines(json_dumps(r) + b"\n" for r in legacy_records)
+        if "history" in data:
+            # Older files nest {"used", "present"} per vehicle
+            used = {k: v["used"] for k, v in data["history"].items()}
+            present = {k: v["present"] for k, v in data["history"].items()}
+        else:
+            used = data.get("used", {})
+            present = data.get("present", {})
         return (
-            data.get("history", {}),
+            used,
+            present,
             data.get("last_index", -1),
-            data.get("vehicle_set", []),
-            data.get("records", [])
+            data.get("vehicle_set", [])
         )
     else:
-        return {}, -1, DEFAULT_VEHICLES.copy(), []
+        return {}, {}, -1, DEFAULT_VEHICLES.copy()
 
-def save_history(history, last_index, vehicle_set, records):
-    with open(HISTORY_FILE, "w") as f:
-        json.dump({
-            "history": history,
+def save_history(used, present, last_index, vehicle_set):
+    # Skip the write when nothing changed since this session last saved
+    h = hash((tuple(used.items()), tuple(present.items()), last_index, tuple(vehicle_set)))
+    if st.session_state.get("_state_hash") == h and os.path.exists(HISTORY_FILE):
+        return
+    # Write to a temp file and swap it in so readers never see a partial file
+    tmp = HISTORY_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(json_dumps({
+            "used": used,
+            "present": present,
             "last_index": last_index,
-            "vehicle_set": vehicle_set,
-            "records": records
-        }, f, indent=4)
-
-def backup_csv(history):
-    """Automatically save a CSV backup of history"""
-    if history:
-        df = pd.DataFrame([
-            {"Vehicle": k, "Used": v["used"], "Present": v["present"]}
-            for k, v in history.items()
-        ])
-        df.to_csv(BACKUP_FILE, index=False)
-
-def select_vehicles(vehicle_set, player_set, num_needed, game_date, ground_name):
-    history, last_index, old_vehicle_set, records = load_history()
+            "vehicle_set": vehicle_set
+        }))
+    os.replace(tmp, HISTORY_FILE)
+    _load_cached.clear()
+    st.session_state._state_hash = h
+
+def flush():
+    """Write the session's in-memory state back to the history file"""
+    save_history(
+        st.session_state.used,
+        st.session_state.present,
+        st.session_state.last_index,
+        st.session_state.vehicle_set
+    )
+
+def append_record(record):
+    """Append one game record to the JSON-lines log"""
+    with open(RECORDS_FILE, "ab") as f:
+        f.write(json_dumps(record) + b"\n")
+
+def clear_records():
+    open(RECORDS_FILE, "w").close()
+
+def load_recent_records(n=10):
+    """Parse only the last n game records, oldest first"""
+    if not os.path.exists(RECORDS_FILE):
+        return []
+    with open(RECORDS_FILE, "rb") as f:
+        return [json_loads(line) for line in deque(f, maxlen=n)]
+
+def backup_csv(used, present):
+    """Automatically save a CSV backup of history, skipped when counts are unchanged"""
+    if used:
+        rows = [(k, u, present[k]) for k, u in used.items()]
+        h = hash(tuple(rows))
+        if st.session_state.get("_csv_hash") == h and os.path.exists(BACKUP_FILE):
+            return
+        with open(BACKUP_FILE, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Vehicle", "Used", "Present"])
+            writer.writerows(rows)
+        st.session_state._csv_hash = h
+
+def history_items(used, present):
+    """Hashable (vehicle, used, present) rows, the cache key for the table, CSV and chart builders"""
+    return tuple((k, u, present[k]) for k, u in used.items())
+
+@st.cache_data(show_spinner=False)
+def history_frame(history_items):
+    """Per-vehicle counts as a columnar DataFrame with the usage ratio precomputed; shared by the CSV export and the chart"""
+    keys = [k for k, _, _ in history_items]
+    used_col = np.fromiter((u for _, u, _ in history_items), dtype=np.int32, count=len(keys))
+    present_col = np.fromiter((p for _, _, p in history_items), dtype=np.int32, count=len(keys))
+    ratio = np.divide(used_col, present_col, out=np.zeros(len(keys)), where=present_col > 0)
+    return pd.DataFrame({"Vehicle": keys, "Used": used_col, "Present": present_col, "Usage Ratio": ratio})
+
+@st.cache_data(show_spinner=False)
+def build_chart(history_items):
+    """Build the usage-ratio bar chart from the cached history_frame"""
+    fig = px.bar(
+        history_frame(history_items),
+        x="Vehicle",
+        y="Usage Ratio",
+        text="Used",
+        hover_data=["Used", "Present"],
+        labels={"Usage Ratio": "Used / Present"},
+        title="Vehicle Usage Fairness Ratio"
+    )
+    fig.update_traces(texttemplate='%{text}', textposition='outside')
+    fig.update_layout(yaxis=dict(range=[0, 1.1]))
+    return fig
+
+@st.cache_data(show_spinner=False)
+def export_csv(history_items):
+    """Encoded CSV download of the vehicle counts from the cached history_frame"""
+    buf = io.BytesIO()
+    history_frame(history_items)[["Vehicle", "Used", "Present"]].to_csv(buf, index=False, encoding='utf-8')
+    return buf.getvalue()
+
+@functools.lru_cache(maxsize=1024)
+def usage_label(used, present):
+    return f"{used} / {present}"
+
+@st.cache_data(show_spinner=False)
+def table_payload(history_items):
+    """Usage table strings from hashable (vehicle, used, present) rows"""
+    # Labels are shared per (used, present) pair, so only new pairs get formatted
+    return {k: usage_label(u, p) for k, u, p in history_items}
 
+def select_vehicles(used, present, last_index, vehicle_set, player_set, num_needed, game_date, ground_name):
     for v in vehicle_set:
-        if v not in history:
-            history[v] = {"used": 0, "present": 0}
+        if v not in used:
+            used[v] = 0
+            present[v] = 0
 
-    for old_v in list(history.keys()):
-        if old_v not in vehicle_set:
-            del history[old_v]
+    vehicle_lookup = set(vehicle_set)
+    for old_v in list(used):
+        if old_v not in vehicle_lookup:
+            del used[old_v]
+            del present[old_v]
 
     # Update presence
     for v in player_set:
-        history[v]["present"] = history.get(v, {"used": 0, "present": 0})["present"] + 1
+        present[v] += 1
 
     # Determine eligible
-    eligible = [v for v in vehicle_set if v in player_set]
+    player_lookup = set(player_set)
+    eligible = [v for v in vehicle_set if v in player_lookup]
     if not eligible:
-        return [], history, last_index, records
+        return [], used, present, last_index
 
     # Sort by usage ratio then round-robin
-    ordered = sorted(
-        eligible,
-        key=lambda v: (
-            history[v]["used"] / history[v]["present"] if history[v]["present"] > 0 else 0,
-            (vehicle_set.index(v) - last_index) % len(vehicle_set)
-        )
-    )
-
-    selected = ordered[:num_needed]
+    pos = {v: i for i, v in enumerate(vehicle_set)}
+    n = len(vehicle_set)
+    keyed = [
+        (used[v] / present[v] if present[v] else 0, (pos[v] - last_index) % n, v)
+        for v in eligible
+    ]
+    selected = [t[-1] for t in heapq.nsmallest(num_needed, keyed)]
 
     # Update usage and round-robin pointer
     for v in selected:
-        history[v]["used"] += 1
+        used[v] += 1
     if selected:
-        last_index = vehicle_set.index(selected[-1])
+        last_index = pos[selected[-1]]
 
     # Log record
-    records.append({
+    append_record({
         "date": str(game_date),
         "ground": ground_name,
         "selected": selected
     })
 
-    save_history(history, last_index, vehicle_set, records)
-    backup_csv(history)  # <-- automatic CSV backup
+    save_history(used, present, last_index, vehicle_set)
+    backup_csv(used, present)  # <-- automatic CSV backup
 
-    return selected, history, last_index, records
+    return selected, used, present, last_index
 
 # -----------------------------
 # Streamlit Interface
@@ -103,42 +224,57 @@ st.set_page_config(page_title="Fair Vehicle Selector Cloud", page_icon="🚗", l
 st.title("🚗 Fair Vehicle Selector (Cloud Ready)")
 st.caption("Attendance-aware selection with automatic CSV backup, import/export, charts, and reset option.")
 
-history, last_index, vehicle_set, records = load_history()
+# Load state once per session; reruns work from memory
+if "used" not in st.session_state:
+    (
+        st.session_state.used,
+        st.session_state.present,
+        st.session_state.last_index,
+        st.session_state.vehicle_set
+    ) = load_history()
+    st.session_state.recent = deque(reversed(load_recent_records(10)), maxlen=10)
+used = st.session_state.used
+present = st.session_state.present
+last_index = st.session_state.last_index
+vehicle_set = st.session_state.vehicle_set
 
 # --- Reset Button ---
 st.subheader("⚙️ Admin Controls")
 if st.button("🧹 Reset History and Records"):
-    history = {}
-    last_index = -1
-    records = []
-    vehicle_set = DEFAULT_VEHICLES.copy()
-    save_history(history, last_index, vehicle_set, records)
+    st.session_state.used = used = {}
+    st.session_state.present = present = {}
+    st.session_state.last_index = last_index = -1
+    st.session_state.vehicle_set = vehicle_set = DEFAULT_VEHICLES.copy()
+    flush()
+    clear_records()
+    st.session_state.recent.clear()
     st.success("✅ History and records have been reset.")
 
 # --- Import CSV to Restore History ---
 uploaded_file = st.file_uploader("📂 Upload history CSV to restore", type="csv")
 if uploaded_file:
     try:
-        df = pd.read_csv(uploaded_file)
-        history = {}
-        records = []
-        last_index = -1
-        vehicle_set = list(df['Vehicle'].unique())
-        for _, row in df.iterrows():
-            history[row['Vehicle']] = {"used": int(row['Used']), "present": int(row['Present'])}
-        save_history(history, last_index, vehicle_set, records)
-        backup_csv(history)
+        df = pd.read_csv(
+            uploaded_file,
+            dtype={"Vehicle": str, "Used": np.int32, "Present": np.int32},
+            engine="c"
+        )
+        vehicles = df['Vehicle'].tolist()
+        st.session_state.used = used = dict(zip(vehicles, df['Used'].tolist()))
+        st.session_state.present = present = dict(zip(vehicles, df['Present'].tolist()))
+        st.session_state.last_index = last_index = -1
+        st.session_state.vehicle_set = vehicle_set = list(dict.fromkeys(vehicles))
+        flush()
+        clear_records()
+        st.session_state.recent.clear()
+        backup_csv(used, present)
         st.success("✅ History restored from CSV")
     except Exception as e:
         st.error(f"⚠️ Failed to restore CSV: {e}")
 
 # --- Export History CSV ---
-if history:
-    export_df = pd.DataFrame([
-        {"Vehicle": k, "Used": v["used"], "Present": v["present"]}
-        for k, v in history.items()
-    ])
-    csv_data = export_df.to_csv(index=False).encode('utf-8')
+if used:
+    csv_data = export_csv(history_items(used, present))
     st.download_button(
         label="💾 Download History as CSV",
         data=csv_data,
@@ -152,9 +288,9 @@ new_vehicle = st.text_input("Add new vehicle owner:")
 if st.button("Add Vehicle"):
     if new_vehicle and new_vehicle not in vehicle_set:
         vehicle_set.append(new_vehicle)
-        history[new_vehicle] = {"used": 0, "present": 0}
-        save_history(history, last_index, vehicle_set, records)
-        backup_csv(history)
+        used[new_vehicle] = 0
+        present[new_vehicle] = 0
+        flush()
         st.success(f"✅ Added {new_vehicle}")
     elif new_vehicle in vehicle_set:
         st.warning("⚠️ Already exists.")
@@ -165,10 +301,10 @@ if vehicle_set:
     remove_vehicle = st.selectbox("Remove a vehicle owner (optional):", ["None"] + vehicle_set)
     if remove_vehicle != "None" and st.button("Remove Vehicle"):
         vehicle_set.remove(remove_vehicle)
-        if remove_vehicle in history:
-            del history[remove_vehicle]
-        save_history(history, last_index, vehicle_set, records)
-        backup_csv(history)
+        if remove_vehicle in used:
+            del used[remove_vehicle]
+            del present[remove_vehicle]
+        flush()
         st.success(f"🗑️ Removed {remove_vehicle}")
 
 st.subheader("Current Vehicle Set:")
@@ -179,56 +315,50 @@ st.header("2️⃣ Daily Game Selection")
 if not vehicle_set:
     st.warning("Please add at least one vehicle owner first.")
 else:
-    game_date = st.date_input("Select game date:", value=date.today())
-    ground_name = st.text_input("Ground name:")
-    players_today = st.multiselect("Select players present today:", vehicle_set)
-    num_needed = st.number_input("Number of vehicles needed:", 1, len(vehicle_set), 1)
-
-    if st.button("Select Vehicles"):
-        selected, history, last_index, records = select_vehicles(
-            vehicle_set, players_today, num_needed, game_date, ground_name
+    # Batch the inputs in a form so editing them doesn't rerun the whole script
+    with st.form("selection_form"):
+        game_date = st.date_input("Select game date:", value=date.today())
+        ground_name = st.text_input("Ground name:")
+        players_today = st.multiselect("Select players present today:", vehicle_set)
+        num_needed = st.number_input("Number of vehicles needed:", 1, len(vehicle_set), 1)
+        submitted = st.form_submit_button("Select Vehicles")
+
+    if submitted:
+        selected, used, present, last_index = select_vehicles(
+            used, present, last_index, vehicle_set, players_today, num_needed, game_date, ground_name
         )
+        st.session_state.used, st.session_state.present, st.session_state.last_index = used, present, last_index
         if not selected:
             st.warning("⚠️ No eligible vehicles today.")
         else:
+            st.session_state.recent.appendleft({
+                "date": str(game_date),
+                "ground": ground_name,
+                "selected": selected
+            })
             st.success(f"✅ Vehicles selected for {game_date} ({ground_name}):")
             st.write(selected)
 
 # --- Section 3: Usage History Table ---
 st.header("3️⃣ Vehicle Usage History")
-if history:
-    table_data = {k: f"{v['used']} / {v['present']}" for k, v in history.items()}
+if used:
+    table_data = table_payload(history_items(used, present))
     st.table(table_data)
 else:
     st.info("No data yet for history.")
 
 # --- Section 3b: Usage vs Attendance Chart ---
 st.header("📊 Usage vs Attendance Chart")
-if history:
-    chart_data = pd.DataFrame([
-        {"Vehicle": k, "Used": v["used"], "Present": v["present"]}
-        for k, v in history.items()
-    ])
-    chart_data["Usage Ratio"] = chart_data["Used"] / chart_data["Present"]
-    fig = px.bar(
-        chart_data,
-        x="Vehicle",
-        y="Usage Ratio",
-        text="Used",
-        hover_data=["Used", "Present"],
-        labels={"Usage Ratio": "Used / Present"},
-        title="Vehicle Usage Fairness Ratio"
-    )
-    fig.update_traces(texttemplate='%{text}', textposition='outside')
-    fig.update_layout(yaxis=dict(range=[0, 1.1]))
+if used:
+    fig = build_chart(history_items(used, present))
     st.plotly_chart(fig, use_container_width=True)
 else:
     st.info("No data yet for chart.")
 
 # --- Section 4: Past Game Records ---
 st.header("4️⃣ Recent Game Records")
-if records:
-    for r in reversed(records[-10:]):
+if st.session_state.recent:
+    for r in st.session_state.recent:
         st.write(f"📅 {r['date']} — {r['ground']} — 🚘 {', '.join(r['selected'])}")
 else:
     st.info("No game records yet.")
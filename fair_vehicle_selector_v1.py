@@ -1,164 +1,200 @@
 import streamlit as st
-import json
 from datetime import date
+import numpy as np
 import pandas as pd
 import plotly.express as px
-import time
+from vehicle_management import open_or_create_spreadsheet, get_worksheets, to_records, build_backup_json, build_history_csv, vehicle_lookup, get_gsheet_client, admin_login, mark_pending, flush_pending_writes, restore_backup, retry_on_quota, append_rows, rewrite_ws, delete_rows, batch_rewrite
 
 # Optional Google Sheets integration
 try:
     import gspread
-    from google.oauth2.service_account import Credentials
-    GOOGLE_SHEETS_AVAILABLE = True
-except:
-    GOOGLE_SHEETS_AVAILABLE = False
+except ImportError:
+    gspread = None
 
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets","https://www.googleapis.com/auth/drive"]
 SHEET_NAME = "Team Management Data"
+SHEET_ID_PATH = ".sheet_id"
+SHEET_HEADERS = {
+    "Players": ["Player"],
+    "Vehicles": ["Vehicle"],
+    "VehicleGroups": ["Vehicle", "Players"],
+    "History": ["date","ground","players_present","selected_vehicles","message"],
+}
+SHEET_RANGES = {"Players": "Players!A:A", "Vehicles": "Vehicles!A:A", "VehicleGroups": "VehicleGroups!A:B", "History": "History!A:E"}
 
 # -----------------------------
 # Google Sheets Helper Functions
 # -----------------------------
-def get_gsheet_client():
-    if not GOOGLE_SHEETS_AVAILABLE:
-        return None
-    try:
-        if "gcp_service_account" in st.secrets:
-            sa_info = st.secrets["gcp_service_account"]
-            if isinstance(sa_info, str):
-                sa_info = json.loads(sa_info)
-            creds = Credentials.from_service_account_info(sa_info, scopes=SCOPES)
-            client = gspread.authorize(creds)
-            return client
-        else:
-            return None
-    except Exception as e:
-        st.warning(f"Failed to authorize Google Sheets: {e}")
-        return None
+@retry_on_quota
+def batch_get(sh, ranges):
+    """Read several ranges in one values.batchGet call"""
+    return sh.values_batch_get(ranges, params={"majorDimension": "ROWS"}).get("valueRanges", [])
 
 # -----------------------------
 # Google Sheets Data Loader
 # -----------------------------
+@st.cache_resource(show_spinner=False)
+def open_spreadsheet(_client, auth_key):
+    """Open SHEET_NAME by its saved ID, else by name (creating it), once per client"""
+    # Known spreadsheet ID: one direct fetch, no Drive listing or search by name
+    try:
+        with open(SHEET_ID_PATH) as f:
+            return _client.open_by_key(f.read().strip())
+    except (FileNotFoundError, gspread.SpreadsheetNotFound):
+        pass
+    sh = open_or_create_spreadsheet(_client, SHEET_NAME, auth_key)
+    try:
+        with open(SHEET_ID_PATH, "w") as f:
+            f.write(sh.id)
+    except OSError:
+        pass
+    return sh
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_sheet_values(_sh):
+    """Read and parse all four tabs in one batch get; shared by sessions until a write clears it"""
+    value_ranges = batch_get(_sh, list(SHEET_RANGES.values()))
+    if len(value_ranges) != 4:
+        value_ranges = [{}] * 4
+    players = [r["Player"] for r in to_records(value_ranges[0])]
+    vehicles = [r["Vehicle"] for r in to_records(value_ranges[1])]
+    vehicle_groups = {r["Vehicle"]: r["Players"].split(", ") for r in to_records(value_ranges[2])}
+    history_records = to_records(value_ranges[3])
+
+    # Compute usage
+    hist_df = pd.DataFrame(history_records, columns=["players_present", "selected_vehicles"]).fillna("")
+    def name_counts(col):
+        names = hist_df[col].astype(str).str.split(",").explode().str.strip()
+        return names[names != ""].value_counts()
+    usage = pd.concat(
+        [name_counts("selected_vehicles").rename("used"), name_counts("players_present").rename("present")], axis=1
+    ).fillna(0).astype("int64")
+
+    return players, vehicles, vehicle_groups, history_records, usage
+
 def load_gsheet_data(client):
-    """Load all data once per session, throttle reads to reduce quota hits"""
+    """Load all data once per session from the shared cached batch read"""
     try:
-        existing_sheets = [s['name'] for s in client.list_spreadsheet_files()]
-        sh = client.open(SHEET_NAME) if SHEET_NAME in existing_sheets else client.create(SHEET_NAME)
+        sh = open_spreadsheet(client, client.auth_key)
     except Exception as e:
         st.error(f"Failed to open or create spreadsheet: {e}")
-        return None, None, None, None, [], [], {}, [], {}
-    
+        return None, None, None, None, [], [], {}, [], empty_usage()
 
-    def safe_get_records(ws, name):
-        try:
-            return ws.get_all_records()
-        except Exception as e:
-            if "quota" in str(e).lower() or "rate limit" in str(e).lower():
-                st.error(f"⚠️ Google Sheets quota exceeded while reading {name}. Please try again later.")
-            else:
-                st.error(f"❌ Failed to read {name} data: {e}")
-            return []
+    ws = get_worksheets(sh, SHEET_HEADERS, client.auth_key)
+    ws_players, ws_vehicles, ws_groups, ws_history = ws["Players"], ws["Vehicles"], ws["VehicleGroups"], ws["History"]
 
-    def get_or_create_ws(name, headers):
-        try:
-            ws = sh.worksheet(name)
-        except gspread.WorksheetNotFound:
-            ws = sh.add_worksheet(name, rows=100, cols=20)
-            ws.append_row(headers)
-        return ws
-
-    # Throttle reads
-    time.sleep(0.5)
-
-    ws_players = get_or_create_ws("Players", ["Player"])
-    ws_vehicles = get_or_create_ws("Vehicles", ["Vehicle"])
-    ws_groups = get_or_create_ws("VehicleGroups", ["Vehicle", "Players"])
-    ws_history = get_or_create_ws("History", ["date","ground","players_present","selected_vehicles","message"])
-
-    # Read all data once
-    players = [r["Player"] for r in safe_get_records(ws_players, "Players")]
-    time.sleep(0.2)
-    vehicles = [r["Vehicle"] for r in safe_get_records(ws_vehicles, "Vehicles")]
-    time.sleep(0.2)
-    vehicle_groups = {r["Vehicle"]: r["Players"].split(", ") for r in safe_get_records(ws_groups, "VehicleGroups")}
-    time.sleep(0.2)
-    history_records = safe_get_records(ws_history, "History")
-    time.sleep(0.2)
-
-    # Compute usage
-    usage = {}
-    for record in history_records:
-        for p in record.get("players_present","").split(", "):
-            if p not in usage:
-                usage[p] = {"used":0,"present":0}
-            usage[p]["present"] +=1
-        for v in record.get("selected_vehicles","").split(", "):
-            if v not in usage:
-                usage[v] = {"used":0,"present":0}
-            usage[v]["used"] +=1
+    try:
+        players, vehicles, vehicle_groups, history_records, usage = load_sheet_values(sh)
+    except Exception as e:
+        if "quota" in str(e).lower() or "rate limit" in str(e).lower():
+            st.error("⚠️ Google Sheets quota exceeded while reading data. Please try again later.")
+        else:
+            st.error(f"❌ Failed to read sheet data: {e}")
+        players, vehicles, vehicle_groups, history_records, usage = [], [], {}, [], empty_usage()
 
     return ws_players, ws_vehicles, ws_groups, ws_history, players, vehicles, vehicle_groups, history_records, usage
 
 # -----------------------------
 # Incremental Updates (in-memory only)
 # -----------------------------
+def empty_usage():
+    """Usage table: one row per player, used/present counts as int64 columns"""
+    return pd.DataFrame({"used": pd.Series(dtype="int64"), "present": pd.Series(dtype="int64")})
+
+def usage_ratios(usage):
+    """used/present per player, 0 for players with no matches"""
+    return (usage["used"] / usage["present"]).where(usage["present"] > 0, 0.0)
+
 def update_usage(selected_players, eligible_players, usage):
-    for p in selected_players:
-        if p not in usage:
-            usage[p] = {"used":0,"present":0}
-        usage[p]["used"] += 1
-    for p in eligible_players:
-        if p not in usage:
-            usage[p] = {"used":0,"present":0}
-        usage[p]["present"] +=1
-
-def select_vehicles_auto(vehicle_set, players_today, num_needed, usage, vehicle_groups):
+    for p in dict.fromkeys(list(selected_players) + list(eligible_players)):
+        if p not in usage.index:
+            usage.loc[p] = 0
+    for col, names in (("used", selected_players), ("present", eligible_players)):
+        counts = usage[col].to_numpy(copy=True)
+        np.add.at(counts, usage.index.get_indexer(list(names)), 1)
+        usage[col] = counts
+
+def history_row(r):
+    """Sheet row for a history record, joining list fields the way they are stored"""
+    players_str = ", ".join(r["players_present"]) if isinstance(r["players_present"], list) else r["players_present"]
+    vehicles_str = ", ".join(r["selected_vehicles"]) if isinstance(r["selected_vehicles"], list) else r["selected_vehicles"]
+    return [r["date"], r["ground"], players_str, vehicles_str, r["message"]]
+
+def sheet_rows(name, data):
+    """Header plus data rows for one sheet, as written by the save buttons"""
+    if name == "VehicleGroups":
+        rows = [[k, ", ".join(v)] for k, v in data.items()]
+    elif name == "History":
+        rows = [history_row(r) for r in data]
+    else:
+        rows = [[x] for x in data]
+    return [SHEET_HEADERS[name]] + rows
+
+def select_vehicles_auto(vehicle_set, vehicle_order, players_today, num_needed, usage, vehicle_groups):
     selected = []
-    eligible = [v for v in players_today if v in vehicle_set]
+    group_of = {}
+    for members in vehicle_groups.values():
+        for m in members:
+            group_of.setdefault(m, frozenset(members))
+    eligible = {v for v in players_today if v in vehicle_set}
     for _ in range(num_needed):
         if not eligible:
             break
-        def usage_ratio(p):
-            u = usage.get(p, {"used":0,"present":0})
-            return u["used"]/u["present"] if u["present"]>0 else 0
-        ordered = sorted(eligible, key=lambda p: (usage_ratio(p), vehicle_set.index(p)))
-        pick = ordered[0]
+        # Ratios shift for everyone still eligible after each pick, so take the min of fresh keys
+        names = list(eligible)
+        ratio = usage_ratios(usage.reindex(names, fill_value=0)).to_numpy()
+        pick = min(zip(ratio, (vehicle_order[p] for p in names), names))[2]
         selected.append(pick)
-        update_usage([pick], eligible, usage)
-        for members in vehicle_groups.values():
-            if pick in members:
-                eligible = [e for e in eligible if e not in members]
-                break
-        else:
-            eligible.remove(pick)
+        update_usage([pick], names, usage)
+        eligible -= group_of.get(pick, {pick})
     return selected
 
+@st.cache_data(show_spinner=False)
 def generate_message(game_date, ground_name, players, selected):
-    message = (
-        f"🏏 Match Details\n"
-        f"📅 Date: {game_date}\n"
-        f"📍 Venue: {ground_name}\n\n"
-        f"👥 Team:\n" + "\n".join([f"- {p}" for p in players]) + "\n\n"
-        f"🚗 Vehicles:\n" + "\n".join([f"- {v}" for v in selected])
-    )
-    return message
+    """Copy-ready match message; players/selected are tuples so reruns hit the cache"""
+    return "\n".join((
+        "🏏 Match Details",
+        f"📅 Date: {game_date}",
+        f"📍 Venue: {ground_name}",
+        "",
+        "👥 Team:",
+        "\n".join(f"- {p}" for p in players),
+        "",
+        "🚗 Vehicles:",
+        "\n".join(f"- {v}" for v in selected),
+    ))
+
+@st.cache_data(show_spinner=False)
+def build_usage_table(usage, vehicles):
+    """Usage table for vehicle owners, sorted by player; cached on usage contents and owners"""
+    owned = usage[usage.index.isin(vehicles)]
+    df_usage = pd.DataFrame({
+        "Player": owned.index,
+        "Vehicle_Used": owned["used"].to_numpy(),
+        "Matches_Played": owned["present"].to_numpy(),
+        "Ratio": usage_ratios(owned).to_numpy()
+    })
+    df_usage = df_usage.sort_values("Player").reset_index(drop=True)
+    df_usage.index = df_usage.index + 1
+    df_usage.index.name = "S.No"
+    return df_usage
+
+@st.cache_data(show_spinner=False)
+def build_usage_chart(df_usage):
+    """Usage-ratio bar chart; cached on the DataFrame contents"""
+    fig = px.bar(df_usage, x="Player", y="Ratio", text="Vehicle_Used", title="Player Vehicle Usage Fairness")
+    fig.update_traces(textposition='outside')
+    fig.update_layout(yaxis=dict(range=[0,1.2]))
+    return fig
 
-# -----------------------------
-# Admin Login
-# -----------------------------
 if "admin_logged_in" not in st.session_state:
     st.session_state.admin_logged_in = False
+if "pending_writes" not in st.session_state:
+    st.session_state.pending_writes = set()
 
 if not st.session_state.admin_logged_in:
-    st.subheader("🔒 Admin Login")
-    username = st.text_input("Username")
-    password = st.text_input("Password", type="password")
-    if st.button("Login"):
-        if username=="admin" and password=="admin123":
-            st.session_state.admin_logged_in = True
-            st.success("✅ Logged in as Admin")
-        else:
-            st.error("❌ Incorrect username or password")
+    admin_login()
+elif st.session_state.pop("just_logged_in", False):
+    st.success("✅ Logged in as Admin")
 
 # -----------------------------
 # Streamlit UI
@@ -172,12 +208,18 @@ client = get_gsheet_client()
 # Load all data once per session
 if client and "gsheet_data" not in st.session_state:
     st.session_state.gsheet_data = load_gsheet_data(client)
+    # Rows currently on the History sheet, so saves can append/trim without reading it back
+    st.session_state.history_synced = [history_row(r) for r in st.session_state.gsheet_data[7]]
+    # Columnar copy of history for rendering; kept in step with the list on append/undo
+    st.session_state.history_df = pd.DataFrame(st.session_state.history_synced, columns=SHEET_HEADERS["History"])
 
 if client:
     ws_players, ws_vehicles, ws_groups, ws_history, players, vehicles, vehicle_groups, history, usage = st.session_state.gsheet_data
+    history_df = st.session_state.history_df
 else:
     st.warning("⚠️ Google Sheets not available. Admin operations disabled.")
-    players, vehicles, vehicle_groups, history, usage = [], [], {}, [], {}
+    players, vehicles, vehicle_groups, history, usage = [], [], {}, [], empty_usage()
+    history_df = pd.DataFrame(columns=SHEET_HEADERS["History"])
 
 # -----------------------------
 # Sidebar Admin Controls
@@ -189,18 +231,10 @@ if st.session_state.admin_logged_in and client:
     if "backup_downloaded" not in st.session_state:
         st.session_state.backup_downloaded = False
 
-    # Prepare backup data
-    backup_data = {
-        "Players":[{"Player":p} for p in players],
-        "Vehicles":[{"Vehicle":v} for v in vehicles],
-        "VehicleGroups":[{"Vehicle":k,"Players":", ".join(v)} for k,v in vehicle_groups.items()],
-        "History":history
-    }
-
     # Download backup button
     if st.sidebar.download_button(
         "📥 Download Backup",
-        json.dumps(backup_data, indent=4),
+        build_backup_json(tuple(players), tuple(vehicles), vehicle_groups, history),
         file_name=f"backup_before_reset_{date.today()}.json",
         mime="application/json"
     ):
@@ -211,17 +245,21 @@ if st.session_state.admin_logged_in and client:
     reset_disabled = not st.session_state.backup_downloaded
     if st.sidebar.button("🧹 Reset All (Backup Mandatory)", disabled=reset_disabled):
         try:
-            # Clear in-memory data
-            players, vehicles, vehicle_groups, history, usage = [], [], {}, [], {}
-            # Clear Google Sheets
-            ws_players.clear()
-            ws_players.append_row(["Player"])
-            ws_vehicles.clear()
-            ws_vehicles.append_row(["Vehicle"])
-            ws_groups.clear()
-            ws_groups.append_row(["Vehicle","Players"])
-            ws_history.clear()
-            ws_history.append_row(["date","ground","players_present","selected_vehicles","message"])
+            # Clear in-memory data in place, so the session's copies are cleared too
+            for data in (players, vehicles, vehicle_groups, history):
+                data.clear()
+            usage.drop(usage.index, inplace=True)
+            history_df.drop(history_df.index, inplace=True)
+            # Clear Google Sheets and rewrite the headers: one batch clear + one batch update
+            sh = open_spreadsheet(client, client.auth_key)
+            batch_rewrite(
+                sh,
+                [f"{n}!A:Z" for n in SHEET_HEADERS],
+                [{"range": f"{n}!A1", "values": [headers]} for n, headers in SHEET_HEADERS.items()]
+            )
+            st.session_state.history_synced = []
+            st.session_state.pending_writes.clear()
+            load_sheet_values.clear()
             st.sidebar.success("✅ All data reset")
             # Reset backup flag
             st.session_state.backup_downloaded = False
@@ -235,17 +273,30 @@ if st.session_state.admin_logged_in and client:
     if st.sidebar.button("↩ Undo Last Entry"):
         if history:
             history.pop()
+            history_df.drop(history_df.index[-1], inplace=True)
+            mark_pending("History")
             st.sidebar.success("✅ Last entry removed from memory, save history to google sheet in section 4")
 
     # Upload
     upload_file = st.sidebar.file_uploader("Upload Backup JSON", type="json")
     if upload_file:
-        data = json.load(upload_file)
-        players = [p["Player"] for p in data.get("Players",[])]
-        vehicles = [v["Vehicle"] for v in data.get("Vehicles",[])]
-        vehicle_groups = {g["Vehicle"]: g["Players"].split(", ") for g in data.get("VehicleGroups",[])}
-        history = data.get("History",[])
-        st.sidebar.success("✅ Data restored from backup, press respective save buttons to save in google sheet")
+        restore_backup(upload_file, players, vehicles, vehicle_groups, history, history_df, history_row)
+        st.sidebar.success("✅ Data restored from backup, press 💾 Save All Pending Changes (or the respective save buttons) to save in google sheet")
+
+    # Save everything changed since the last save in one go
+    pending_badge = st.sidebar.empty()
+    if st.sidebar.button("💾 Save All Pending Changes"):
+        try:
+            flush_pending_writes(open_spreadsheet(client, client.auth_key), {
+                "Players": players, "Vehicles": vehicles, "VehicleGroups": vehicle_groups, "History": history
+            }, SHEET_RANGES, sheet_rows)
+            load_sheet_values.clear()
+            st.sidebar.success("✅ Pending changes saved to Google Sheet")
+        except Exception as e:
+            if "quota" in str(e).lower() or "rate limit" in str(e).lower():
+                st.sidebar.error("⚠️ Google Sheets quota exceeded. Please try again after a few minutes.")
+            else:
+                st.sidebar.error(f"❌ Failed to save pending changes: {e}")
 
 # -----------------------------
 # Main UI: 7 Sections (All in-memory operations)
@@ -258,18 +309,19 @@ if st.session_state.admin_logged_in:
     if st.button("Add Player"):
         if new_player and new_player not in players:
             players.append(new_player)
+            mark_pending("Players")
             st.success(f"✅ Added player: {new_player}")
     if players:
         remove_player_name = st.selectbox("Remove a player:", ["None"]+players)
         if remove_player_name!="None" and st.button("Remove Player"):
             players.remove(remove_player_name)
+            mark_pending("Players")
             st.success(f"🗑️ Removed player: {remove_player_name}")
     if st.button("💾 Save Players to Google Sheet") and client:
         try:
-            ws_players.clear()
-            ws_players.append_row(["Player"])
-            for p in players:
-                ws_players.append_row([p])
+            rewrite_ws(ws_players, sheet_rows("Players", players))
+            st.session_state.pending_writes.discard("Players")
+            load_sheet_values.clear()
             st.success("✅ Players saved to Google Sheet")
         except Exception as e:
             if "quota" in str(e).lower() or "rate limit" in str(e).lower():
@@ -286,6 +338,7 @@ if st.session_state.admin_logged_in:
     if st.button("Add Vehicle"):
         if new_vehicle in players and new_vehicle not in vehicles:
             vehicles.append(new_vehicle)
+            mark_pending("Vehicles")
             st.success(f"✅ Added vehicle owner: {new_vehicle}")
         else:
             st.warning("⚠️ Vehicle owner must exist in players and not duplicate")
@@ -293,13 +346,13 @@ if st.session_state.admin_logged_in:
         remove_vehicle_name = st.selectbox("Remove vehicle owner:", ["None"]+vehicles)
         if remove_vehicle_name!="None" and st.button("Remove Vehicle"):
             vehicles.remove(remove_vehicle_name)
+            mark_pending("Vehicles")
             st.success(f"🗑️ Removed vehicle: {remove_vehicle_name}")
     if st.button("💾 Save Vehicles to Google Sheet") and client:
         try:
-            ws_vehicles.clear()
-            ws_vehicles.append_row(["Vehicle"])
-            for v in vehicles:
-                ws_vehicles.append_row([v])
+            rewrite_ws(ws_vehicles, sheet_rows("Vehicles", vehicles))
+            st.session_state.pending_writes.discard("Vehicles")
+            load_sheet_values.clear()
             st.success("✅ Vehicles saved to Google Sheet")
         except Exception as e:
             if "quota" in str(e).lower() or "rate limit" in str(e).lower():
@@ -317,13 +370,13 @@ if st.session_state.admin_logged_in:
     if st.button("Add/Update Vehicle Group"):
         if vg_vehicle:
             vehicle_groups[vg_vehicle] = vg_members
+            mark_pending("VehicleGroups")
             st.success(f"✅ Group updated for {vg_vehicle}")
     if st.button("💾 Save Vehicle Groups to Google Sheet") and client:
         try:
-            ws_groups.clear()
-            ws_groups.append_row(["Vehicle","Players"])
-            for k,v in vehicle_groups.items():
-                ws_groups.append_row([k, ", ".join(v)])
+            rewrite_ws(ws_groups, sheet_rows("VehicleGroups", vehicle_groups))
+            st.session_state.pending_writes.discard("VehicleGroups")
+            load_sheet_values.clear()
             st.success("✅ Vehicle groups saved to Google Sheet")
         except Exception as e:
             if "quota" in str(e).lower() or "rate limit" in str(e).lower():
@@ -353,9 +406,10 @@ if st.session_state.admin_logged_in:
         manual_selected = []
 
     if st.button("Select Vehicles"):
-        eligible = [v for v in players_today if v in vehicles]
+        vehicle_set, vehicle_order = vehicle_lookup(vehicles)
+        eligible = [v for v in players_today if v in vehicle_set]
         if selection_mode=="Auto-Select":
-            selected = select_vehicles_auto(vehicles, players_today, num_needed, usage, vehicle_groups)
+            selected = select_vehicles_auto(vehicle_set, vehicle_order, players_today, num_needed, usage, vehicle_groups)
         else:
             if len(manual_selected) != num_needed:
                 st.warning(f"⚠️ Select exactly {num_needed} vehicles")
@@ -364,7 +418,7 @@ if st.session_state.admin_logged_in:
                 selected = manual_selected
                 update_usage(selected, eligible, usage)
         if selected:
-            msg = generate_message(game_date, ground_name, players_today, selected)
+            msg = generate_message(game_date, ground_name, tuple(players_today), tuple(selected))
             st.subheader("📋 Copy-Ready Message")
             st.text_area("Message:", msg, height=200)
             # Store in memory
@@ -375,22 +429,29 @@ if st.session_state.admin_logged_in:
                 "selected_vehicles": selected,
                 "message": msg
             })
+            history_df.loc[len(history_df)] = history_row(history[-1])
+            mark_pending("History")
             st.success(f"✅ Vehicles selected: {', '.join(selected)}")
 
     if st.button("💾 Save Match History to Google Sheet") and client:
         try:
-            ws_history.clear()
-            ws_history.append_row(["date","ground","players_present","selected_vehicles","message"])
-            for r in history:
-                players_str = ", ".join(r["players_present"]) if isinstance(r["players_present"], list) else r["players_present"]
-                vehicles_str = ", ".join(r["selected_vehicles"]) if isinstance(r["selected_vehicles"], list) else r["selected_vehicles"]
-                ws_history.append_row([
-                    r["date"],
-                    r["ground"],
-                    players_str,
-                    vehicles_str,
-                    r["message"]
-                ])
+            rows = [history_row(r) for r in history]
+            synced = st.session_state.history_synced
+            n = 0
+            while n < min(len(rows), len(synced)) and rows[n] == synced[n]:
+                n += 1
+            if n == len(synced):
+                # Only new matches since the last save: append them
+                if rows[n:]:
+                    append_rows(ws_history, rows[n:])
+            elif n == len(rows):
+                # Entries were undone: drop the trailing rows (row 1 is the header)
+                delete_rows(ws_history, n + 2, len(synced) + 1)
+            else:
+                rewrite_ws(ws_history, [SHEET_HEADERS["History"]] + rows)
+            st.session_state.history_synced = rows
+            st.session_state.pending_writes.discard("History")
+            load_sheet_values.clear()
             st.success("✅ Match history saved to Google Sheet")
         except Exception as e:
             if "quota" in str(e).lower() or "rate limit" in str(e).lower():
@@ -400,48 +461,37 @@ if st.session_state.admin_logged_in:
 
 # 5️⃣ Usage Table & Chart
 st.header("5️⃣ Vehicle Usage")
-if usage:
-    df_usage = pd.DataFrame([
-        {"Player": k, "Vehicle_Used": v["used"], "Matches_Played": v["present"], "Ratio": v["used"]/v["present"] if v["present"]>0 else 0}
-        for k,v in usage.items() if k in vehicles
-    ])
-    df_usage = df_usage.sort_values("Player").reset_index(drop=True)
-    df_usage.index = df_usage.index + 1
-    df_usage.index.name = "S.No"
+if not usage.empty:
+    df_usage = build_usage_table(usage, tuple(vehicles))
     st.table(df_usage)
-    fig = px.bar(df_usage, x="Player", y="Ratio", text="Vehicle_Used", title="Player Vehicle Usage Fairness")
-    fig.update_traces(textposition='outside')
-    fig.update_layout(yaxis=dict(range=[0,1.2]))
+    fig = build_usage_chart(df_usage)
     st.plotly_chart(fig, use_container_width=True)
 else:
     st.info("No usage data yet")
 
 # 6️⃣ Recent Match Records
 st.header("6️⃣ Recent Match Records")
-if history:
-    for r in reversed(history[-10:]):
-        vehicles_value = r["selected_vehicles"]
-        if isinstance(vehicles_value, list):
-            display_vehicles = ", ".join(vehicles_value)
-        else:
-            display_vehicles = vehicles_value
-        st.write(f"📅 {r['date']} — {r['ground']} — 🚗 {display_vehicles}")
+if not history_df.empty:
+    for r in history_df.tail(10).iloc[::-1].itertuples(index=False):
+        st.write(f"📅 {r.date} — {r.ground} — 🚗 {r.selected_vehicles}")
 else:
     st.info("No match records yet")
 
 # -----------------------------
 # CSV Download for History (everyone)
 # -----------------------------
-if history:
+if not history_df.empty:
     st.header("📂 Download Match History")
-    df_history = pd.DataFrame(history)  # columns: date, ground, players_present, selected_vehicles, message
-    import io
-    csv_buffer = io.StringIO()
-    df_history.to_csv(csv_buffer, index=False)
     st.download_button(
         "📥 Download History as CSV",
-        data=csv_buffer.getvalue(),
+        data=build_history_csv(history_df),
         file_name="match_history.csv",
         mime="text/csv"
     )
 
+# Pending-changes badge, filled last so it counts this run's edits
+if st.session_state.admin_logged_in and client:
+    if st.session_state.pending_writes:
+        pending_badge.info(f"🕒 Unsaved changes: {', '.join(sorted(st.session_state.pending_writes))}")
+    else:
+        pending_badge.caption("✅ All changes saved")
@@ -1,11 +1,55 @@
 # financial_management.py
 import streamlit as st
 import pandas as pd
-import time
 from datetime import date
+from vehicle_management import open_or_create_spreadsheet, to_records
 
-ROW_DELAY = 0.15  # delay to avoid quota issues
 SHEET_NAME = "Team Financial Data"
+FIN_HEADERS = ["Player", "Total Deposit", "Balance"]
+DEP_HEADERS = ["Player", "Date", "Amount"]
+
+def to_df(value_range, headers):
+    """DataFrame of a tab's records; a tab with no data rows gets the expected headers"""
+    records = to_records(value_range)
+    return pd.DataFrame(records) if records else pd.DataFrame(columns=headers)
+
+def save_sheet(ws, df, prev_rows):
+    """Overwrite a tab with header + rows in one update; blank any rows left over from a longer previous write"""
+    ws.update(
+        values=[df.columns.tolist()] + df.astype(object).values.tolist(),
+        range_name="A1",
+        value_input_option="RAW"
+    )
+    if prev_rows > len(df):
+        ws.batch_clear([f"A{len(df) + 2}:ZZ"])
+
+@st.cache_resource(show_spinner=False)
+def open_financial_sheets(_client, auth_key):
+    """Spreadsheet and its two tab handles, shared across sessions; tabs are created with headers when missing"""
+    sh = open_or_create_spreadsheet(_client, SHEET_NAME, auth_key)
+
+    try:
+        ws_fin = sh.worksheet("Financials")
+    except:
+        ws_fin = sh.add_worksheet("Financials", rows=200, cols=20)
+        ws_fin.append_row(FIN_HEADERS)
+
+    try:
+        ws_dep = sh.worksheet("DepositHistory")
+    except:
+        ws_dep = sh.add_worksheet("DepositHistory", rows=200, cols=20)
+        ws_dep.append_row(DEP_HEADERS)
+    return sh, ws_fin, ws_dep
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_all(_sh):
+    """Read both tabs in one batch get; numbers come back unformatted so sums work"""
+    value_ranges = _sh.values_batch_get(
+        ["Financials", "DepositHistory"],
+        params={"valueRenderOption": "UNFORMATTED_VALUE"}
+    ).get("valueRanges", [])
+    value_ranges += [{}] * (2 - len(value_ranges))
+    return to_df(value_ranges[0], FIN_HEADERS), to_df(value_ranges[1], DEP_HEADERS)
 
 def financial_management(players, client):
     """Financial management - Simple one-time load with direct writes."""
@@ -18,20 +62,7 @@ def financial_management(players, client):
     # Open or create Google Sheets
     # -----------------------------
     try:
-        existing = [s['name'] for s in client.list_spreadsheet_files()]
-        sh = client.open(SHEET_NAME) if SHEET_NAME in existing else client.create(SHEET_NAME)
-
-        try:
-            ws_fin = sh.worksheet("Financials")
-        except:
-            ws_fin = sh.add_worksheet("Financials", rows=200, cols=20)
-            ws_fin.append_row(["Player", "Total Deposit", "Balance"])
-
-        try:
-            ws_dep = sh.worksheet("DepositHistory")
-        except:
-            ws_dep = sh.add_worksheet("DepositHistory", rows=200, cols=20)
-            ws_dep.append_row(["Player", "Date", "Amount"])
+        sh, ws_fin, ws_dep = open_financial_sheets(client, client.auth_key)
     except Exception as e:
         st.error(f"❌ Failed to connect to Google Sheets: {e}")
         return
@@ -40,21 +71,19 @@ def financial_management(players, client):
     # Load existing data
     # -----------------------------
     try:
-        fin_records = ws_fin.get_all_records()
-        df_fin = pd.DataFrame(fin_records)
-    except:
-        df_fin = pd.DataFrame(columns=["Player", "Total Deposit", "Balance"])
-
-    try:
-        dep_records = ws_dep.get_all_records()
-        df_dep = pd.DataFrame(dep_records)
+        df_fin, df_dep = load_all(sh)
     except:
-        df_dep = pd.DataFrame(columns=["Player", "Date", "Amount"])
+        df_fin = pd.DataFrame(columns=FIN_HEADERS)
+        df_dep = pd.DataFrame(columns=DEP_HEADERS)
+    # Data rows currently on each tab, so saves know whether anything needs blanking
+    fin_rows_saved, dep_rows_saved = len(df_fin), len(df_dep)
 
-    # Ensure all players exist
+    # Ensure all players exist (appended in place; match columns start empty and are zeroed below)
+    known = set(df_fin["Player"])
     for p in players:
-        if p not in df_fin["Player"].values:
-            df_fin = pd.concat([df_fin, pd.DataFrame([{"Player": p, "Total Deposit": 0.0, "Balance": 0.0}])], ignore_index=True)
+        if p not in known:
+            df_fin.loc[len(df_fin)] = {"Player": p, "Total Deposit": 0.0, "Balance": 0.0}
+            known.add(p)
 
     df_fin.fillna(0.0, inplace=True)
 
@@ -98,11 +127,8 @@ def financial_management(players, client):
 
             # Write back to Google Sheets
             try:
-                ws_fin.clear()
-                ws_fin.append_row(df_fin.columns.tolist())
-                for _, r in df_fin.iterrows():
-                    ws_fin.append_row([r[c] for c in df_fin.columns])
-                    time.sleep(ROW_DELAY)
+                save_sheet(ws_fin, df_fin, fin_rows_saved)
+                load_all.clear()
                 st.success(f"✅ Match entry added and saved (₹{fee_per_player}/player).")
             except Exception as e:
                 st.error(f"❌ Failed to save match entry: {e}")
@@ -121,10 +147,7 @@ def financial_management(players, client):
             st.warning("⚠️ Enter a valid deposit amount.")
         else:
             # Add to deposit history
-            df_dep = pd.concat([
-                df_dep,
-                pd.DataFrame([{"Player": deposit_player, "Date": str(deposit_date), "Amount": deposit_amount}])
-            ], ignore_index=True)
+            df_dep.loc[len(df_dep)] = {"Player": deposit_player, "Date": str(deposit_date), "Amount": deposit_amount}
 
             # Update total deposit and balance
             if deposit_player in df_fin["Player"].values:
@@ -136,17 +159,9 @@ def financial_management(players, client):
 
             # Write both sheets
             try:
-                ws_fin.clear()
-                ws_fin.append_row(df_fin.columns.tolist())
-                for _, r in df_fin.iterrows():
-                    ws_fin.append_row([r[c] for c in df_fin.columns])
-                    time.sleep(ROW_DELAY)
-
-                ws_dep.clear()
-                ws_dep.append_row(df_dep.columns.tolist())
-                for _, r in df_dep.iterrows():
-                    ws_dep.append_row([r[c] for c in df_dep.columns])
-                    time.sleep(ROW_DELAY)
+                save_sheet(ws_fin, df_fin, fin_rows_saved)
+                save_sheet(ws_dep, df_dep, dep_rows_saved)
+                load_all.clear()
 
                 st.success(f"✅ Deposit of ₹{deposit_amount} added for {deposit_player} and saved.")
             except Exception as e:
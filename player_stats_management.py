@@ -2,40 +2,23 @@ import streamlit as st
 import pandas as pd
 import pdfplumber
 import re
-import time
 import json
 
-def player_stats_management(client):
+STATS_TAB = "PlayerStats"
+STATS_HEADERS = ["Player", "Innings", "Runs", "Average", "StrikeRate"]
+
+def player_stats_management(ws_stats):
     """
     Handles player stats upload (PDF → Google Sheet).
-    Requires a valid gspread client with write access.
+    ws_stats is the PlayerStats handle from the caller's cached get_worksheets
+    (with {STATS_TAB: STATS_HEADERS}), or None when Google Sheets is unavailable.
     """
 
     st.header("📊 Player Stats Management")
     st.caption("Upload batting leaderboard PDFs, extract player data, and save to Google Sheets")
 
-    SHEET_NAME = "Team Management Data"
-    STATS_TAB = "PlayerStats"
-
-    # -----------------------------
-    # Helper: Get or Create Sheet
-    # -----------------------------
-    ws_stats = None
-    if client:
-        try:
-            existing_sheets = [s['name'] for s in client.list_spreadsheet_files()]
-            sh = client.open(SHEET_NAME) if SHEET_NAME in existing_sheets else client.create(SHEET_NAME)
-            try:
-                ws_stats = sh.worksheet(STATS_TAB)
-            except:
-                ws_stats = sh.add_worksheet(STATS_TAB, rows=200, cols=10)
-                ws_stats.append_row(["Player", "Innings", "Runs", "Average", "StrikeRate"])
-        except Exception as e:
-            st.error(f"❌ Failed to open or create Google Sheet: {e}")
-            ws_stats = None
-    else:
+    if not ws_stats:
         st.warning("⚠️ Google Sheets not available.")
-        ws_stats = None
 
     # -----------------------------
     # PDF Upload Section
@@ -55,7 +38,7 @@ def player_stats_management(client):
             matches = re.findall(pattern, text)
 
             if matches:
-                parsed_df = pd.DataFrame(matches, columns=["Player", "Innings", "Runs", "Average", "StrikeRate"])
+                parsed_df = pd.DataFrame(matches, columns=STATS_HEADERS)
                 parsed_df["Innings"] = parsed_df["Innings"].astype(int)
                 parsed_df["Runs"] = parsed_df["Runs"].astype(int)
                 parsed_df["Average"] = parsed_df["Average"].astype(float)
@@ -77,10 +60,11 @@ def player_stats_management(client):
         if st.button("💾 Save Stats to Google Sheet"):
             try:
                 ws_stats.clear()
-                ws_stats.append_row(list(parsed_df.columns))
-                for _, row in parsed_df.iterrows():
-                    ws_stats.append_row(row.tolist())
-                    time.sleep(0.4)  # Prevent rate-limit errors
+                # Header + all rows in one call instead of one append (and a pause) per player
+                ws_stats.append_rows(
+                    [list(parsed_df.columns)] + parsed_df.astype(object).values.tolist(),
+                    value_input_option="RAW"
+                )
                 st.success("✅ Player stats saved to Google Sheet successfully")
             except Exception as e:
                 if "quota" in str(e).lower() or "rate limit" in str(e).lower():
@@ -94,9 +78,10 @@ def player_stats_management(client):
     st.subheader("📈 Current Player Stats (from Google Sheet)")
     if ws_stats:
         try:
-            records = ws_stats.get_all_records()
-            if records:
-                df_stats = pd.DataFrame(records)
+            # Header + rows straight into the DataFrame (no per-row dicts); unformatted keeps numbers numeric
+            values = ws_stats.get_values(value_render_option="UNFORMATTED_VALUE")
+            if len(values) > 1:
+                df_stats = pd.DataFrame(values[1:], columns=values[0])
                 df_stats = df_stats.sort_values("Player").reset_index(drop=True)
                 df_stats.index = df_stats.index + 1
                 df_stats.index.name = "S.No"
@@ -2,10 +2,10 @@
 import sys
 import os
 import streamlit as st
-import json
+import pandas as pd
 from datetime import date
 sys.path.append(os.path.dirname(__file__))
-from vehicle_management import vehicle_management
+from vehicle_management import get_gsheet_client, open_or_create_spreadsheet, get_worksheets, to_records, admin_login, vehicle_management, history_row, sheet_rows, mark_pending, rewrite_ws, SHEET_HEADERS, SHEET_RANGES
 from financial_management import financial_management
 #from player_stats_management import player_stats_management
 from cricket_analytics import cricket_analytics
@@ -13,90 +13,72 @@ from cricket_analytics import cricket_analytics
 # Optional Google Sheets integration
 try:
     import gspread
-    from google.oauth2.service_account import Credentials
-    GOOGLE_SHEETS_AVAILABLE = True
-except:
-    GOOGLE_SHEETS_AVAILABLE = False
+except ImportError:
+    gspread = None
 
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets","https://www.googleapis.com/auth/drive"]
 SHEET_NAME = "Team Management Data"
-
-# -----------------------------
-# Google Sheets Helper Functions
-# -----------------------------
-def get_gsheet_client():
-    if not GOOGLE_SHEETS_AVAILABLE:
-        return None
-    try:
-        if "gcp_service_account" in st.secrets:
-            sa_info = st.secrets["gcp_service_account"]
-            if isinstance(sa_info, str):
-                sa_info = json.loads(sa_info)
-            creds = Credentials.from_service_account_info(sa_info, scopes=SCOPES)
-            client = gspread.authorize(creds)
-            return client
-        else:
-            return None
-    except Exception as e:
-        st.warning(f"Failed to authorize Google Sheets: {e}")
-        return None
+STATS_TABS = ["PlayerStats", "PlayerStatsBowl"]
 
 # -----------------------------
 # Load Google Sheets Data
 # -----------------------------
-@st.cache_data(ttl=300, show_spinner="Loading data from Google Sheets...", hash_funcs={gspread.client.Client: id})
+@st.cache_data(ttl=300, show_spinner="Loading data from Google Sheets...")
+def load_sheet_values(_sh):
+    """Read and parse every tab in one batch get; shared by sessions until a write clears it"""
+    value_ranges = _sh.values_batch_get(list(SHEET_RANGES.values())).get("valueRanges", [])
+    value_ranges += [{}] * (len(SHEET_RANGES) - len(value_ranges))
+    players_rows, vehicles_rows, groups_rows, grounds, history_records = [to_records(vr, numericise=True) for vr in value_ranges]
+
+    # Load data
+    players = [r["Player"] for r in players_rows]
+    vehicles = [r["Vehicle"] for r in vehicles_rows]
+    vehicle_groups = {r["Vehicle"]: r["Players"].split(", ") for r in groups_rows}
+
+    # Compute usage
+    df_history = pd.DataFrame(history_records, columns=["players_present", "selected_vehicles"])
+    def name_counts(column):
+        names = df_history[column].fillna("").astype(str).str.split(",").explode().str.strip()
+        return names[names != ""].value_counts()
+    present = name_counts("players_present")
+    used = name_counts("selected_vehicles")
+    usage = {
+        k: {"used": int(used.get(k, 0)), "present": int(present.get(k, 0))}
+        for k in present.index.union(used.index)
+    }
+
+    return players, vehicles, vehicle_groups, history_records, usage, grounds
+
 def load_gsheet_data(client):
     try:
-        existing_sheets = [s['name'] for s in client.list_spreadsheet_files()]
-        sh = client.open(SHEET_NAME) if SHEET_NAME in existing_sheets else client.create(SHEET_NAME)
+        sh = open_or_create_spreadsheet(client, SHEET_NAME, client.auth_key)
+        ws = get_worksheets(sh, SHEET_HEADERS, client.auth_key)
+        worksheets = [ws[name] for name in ("Players", "Vehicles", "VehicleGroups", "History", "Grounds")]
     except Exception as e:
         st.error(f"Failed to open or create spreadsheet: {e}")
-        return None, None, None, None, [], [], {}, [], {}
-
-    def safe_get_records(ws, name):
-        try:
-            return ws.get_all_records()
-        except Exception as e:
-            if "quota" in str(e).lower() or "rate limit" in str(e).lower():
-                st.error(f"⚠️ Google Sheets quota exceeded while reading {name}. Please try again later.")
-            else:
-                st.error(f"❌ Failed to read {name} data: {e}")
-            return []
+        return None, None, None, None, None, [], [], {}, [], {}, []
 
-    def get_or_create_ws(name, headers):
-        try:
-            ws = sh.worksheet(name)
-        except gspread.WorksheetNotFound:
-            ws = sh.add_worksheet(name, rows=100, cols=20)
-            ws.append_row(headers)
-        return ws
-
-    ws_players = get_or_create_ws("Players", ["Player"])
-    ws_vehicles = get_or_create_ws("Vehicles", ["Vehicle"])
-    ws_groups = get_or_create_ws("VehicleGroups", ["Vehicle", "Players"])
-    ws_grounds = get_or_create_ws("Grounds", ["Ground", "KM"])  
-    ws_history = get_or_create_ws("History", ["date","players_present","selected_vehicles","message"])
-
-    # Load data
-    players = [r["Player"] for r in safe_get_records(ws_players, "Players")]
-    vehicles = [r["Vehicle"] for r in safe_get_records(ws_vehicles, "Vehicles")]
-    vehicle_groups = {r["Vehicle"]: r["Players"].split(", ") for r in safe_get_records(ws_groups, "VehicleGroups")}
-    grounds = safe_get_records(ws_grounds, "Grounds")
-    history_records = safe_get_records(ws_history, "History")
+    # Read errors are reported here rather than cached as empty data
+    try:
+        data = load_sheet_values(sh)
+    except Exception as e:
+        if "quota" in str(e).lower() or "rate limit" in str(e).lower():
+            st.error("⚠️ Google Sheets quota exceeded while reading data. Please try again later.")
+        else:
+            st.error(f"❌ Failed to read sheet data: {e}")
+        data = [], [], {}, [], {}, []
 
-    # Compute usage
-    usage = {}
-    for record in history_records:
-        for p in record.get("players_present","").split(", "):
-            if p not in usage:
-                usage[p] = {"used":0,"present":0}
-            usage[p]["present"] +=1
-        for v in record.get("selected_vehicles","").split(", "):
-            if v not in usage:
-                usage[v] = {"used":0,"present":0}
-            usage[v]["used"] +=1
+    return (*worksheets, *data)
 
-    return ws_players, ws_vehicles, ws_groups, ws_history, ws_grounds, players, vehicles, vehicle_groups, history_records, usage, grounds
+@st.cache_data(ttl=300, show_spinner=False)
+def load_stats_values(_sh):
+    """Batting and bowling stats records from one batch get, cached like load_sheet_values"""
+    try:
+        value_ranges = _sh.values_batch_get(STATS_TABS).get("valueRanges", [])
+    except gspread.exceptions.APIError:
+        # A missing tab fails the whole batch; the batting tab alone is still worth showing
+        value_ranges = [_sh.values_get(STATS_TABS[0])]
+    value_ranges += [{}] * (len(STATS_TABS) - len(value_ranges))
+    return [to_records(vr, numericise=True) for vr in value_ranges]
 
 # -----------------------------
 # Streamlit Setup
@@ -106,29 +88,32 @@ st.title("🏏 Team RRR Management 🏏")
 
 if "admin_logged_in" not in st.session_state:
     st.session_state.admin_logged_in = False
+if "pending_writes" not in st.session_state:
+    st.session_state.pending_writes = set()
 
 with st.sidebar:
     if not st.session_state.admin_logged_in:
-        st.subheader("🔒 Admin Login")
-        username = st.text_input("Username")
-        password = st.text_input("Password", type="password")
-        if st.button("Login"):
-            if username=="admin" and password=="admin123":
-                st.session_state.admin_logged_in = True
-                st.success("✅ Logged in as Admin")
-            else:
-                st.error("❌ Incorrect username or password")
+        admin_login()
+    elif st.session_state.pop("just_logged_in", False):
+        st.success("✅ Logged in as Admin")
 
 # Load Google Sheet data
 client = get_gsheet_client()
 if client and "gsheet_data" not in st.session_state:
     st.session_state.gsheet_data = load_gsheet_data(client)
+    # Rows currently on the History sheet, so saves can append/trim without rewriting it
+    st.session_state.history_synced = [history_row(r) for r in st.session_state.gsheet_data[8]]
+    # Columnar copy of history for rendering; kept in step with the list on append/undo
+    st.session_state.history_df = pd.DataFrame(st.session_state.history_synced, columns=SHEET_HEADERS["History"])
 
 if client:
     ws_players, ws_vehicles, ws_groups, ws_history, ws_grounds, players, vehicles, vehicle_groups, history, usage, grounds = st.session_state.gsheet_data
+    history_df = st.session_state.history_df
 else:
     st.warning("⚠️ Google Sheets not available. Admin operations disabled.")
-    players, vehicles, vehicle_groups, history, usage = [], [], {}, [], {}
+    players, vehicles, vehicle_groups, history, usage, grounds = [], [], {}, [], {}, []
+    ws_players = ws_vehicles = ws_groups = ws_history = ws_grounds = None
+    history_df = pd.DataFrame(columns=SHEET_HEADERS["History"])
 
 # -----------------------------
 # Tabs Integration
@@ -144,10 +129,13 @@ with tabs[0]:
 # -----------------------------
     st.header("👥 Player Superset")
 
+    try:
+        stats_data, stats_data_bowl = load_stats_values(open_or_create_spreadsheet(client, SHEET_NAME, client.auth_key))
+    except Exception:
+        stats_data, stats_data_bowl = [], []
+
     player_stats = {}
     try:
-        ws_stats = client.open(SHEET_NAME).worksheet("PlayerStats")
-        stats_data = ws_stats.get_all_records()
         for row in stats_data:
             player_name = row.get("Player")
             if player_name:
@@ -162,9 +150,7 @@ with tabs[0]:
     
     player_stats_bowl = {}
     try:
-        ws_stats = client.open(SHEET_NAME).worksheet("PlayerStatsBowl")
-        stats_data = ws_stats.get_all_records()
-        for row in stats_data:
+        for row in stats_data_bowl:
             player_name = row.get("Player")
             if player_name:
                 player_stats_bowl[player_name] = {
@@ -192,6 +178,7 @@ with tabs[0]:
         if st.button("Add Player", key="add_player_btn",disabled=admin_disabled):
             if new_player and new_player not in players:
                 players.append(new_player)
+                mark_pending("Players")
                 st.success(f"✅ Added player: {new_player}")
             else:
                 st.warning("⚠️ Player name is empty or already exists.")
@@ -204,14 +191,14 @@ with tabs[0]:
             )
             if remove_player != "None" and st.button("🗑️ Remove Player", key="remove_player_btn",disabled=admin_disabled):
                 players.remove(remove_player)
+                mark_pending("Players")
                 st.success(f"🗑️ Removed player: {remove_player}")
         # Save to Google Sheet
         if st.button("💾 Save Players to Google Sheet", key="save_players_btn", disabled=admin_disabled) and client:
             try:
-                ws_players.clear()
-                ws_players.append_row(["Player"])
-                for p in sorted(players):
-                    ws_players.append_row([p])
+                rewrite_ws(ws_players, sheet_rows("Players", players))
+                st.session_state.pending_writes.discard("Players")
+                load_sheet_values.clear()
                 st.success("✅ Players saved to Google Sheet")
             except Exception as e:
                 if "quota" in str(e).lower() or "rate limit" in str(e).lower():
@@ -308,7 +295,8 @@ with tabs[0]:
 # Tab 2: Vehicle Management
 # -----------------------------
 with tabs[1]:
-    vehicle_management(players, vehicles, vehicle_groups, history, usage, grounds, client, ws_players, ws_vehicles, ws_groups, ws_history, ws_grounds)
+    vehicle_management(players, vehicles, vehicle_groups, history, history_df, usage, grounds, client, ws_players, ws_vehicles, ws_groups, ws_history, ws_grounds,
+                       load_sheet_values.clear)
 
 # -----------------------------
 # Tab 3: Financial Management (Placeholder)
@@ -1,11 +1,144 @@
 import streamlit as st
+import functools
 import json
+import hashlib
+import hmac
 import datetime
-import pandas as pd
-import plotly.express as px
-import time
-import matplotlib.pyplot as plt
+import heapq
 import io
+import random
+import time
+import pandas as pd
+
+# Optional Google Sheets integration
+try:
+    import gspread
+    from google.oauth2.service_account import Credentials
+    GOOGLE_SHEETS_AVAILABLE = True
+except:
+    GOOGLE_SHEETS_AVAILABLE = False
+
+# Optional fast JSON backend
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets","https://www.googleapis.com/auth/drive"]
+HISTORY_HEADERS = ["date","ground","km","players_present","excluded_vehicle_owners","selected_vehicles","message"]
+SHEET_HEADERS = {
+    "Players": ["Player"],
+    "Vehicles": ["Vehicle"],
+    "VehicleGroups": ["Vehicle", "Players"],
+    "Grounds": ["Ground", "KM"],
+    "History": HISTORY_HEADERS
+}
+SHEET_RANGES = {
+    "Players": "Players!A:A",
+    "Vehicles": "Vehicles!A:A",
+    "VehicleGroups": "VehicleGroups!A:B",
+    "Grounds": "Grounds!A:B",
+    "History": "History!A:G"
+}
+
+# -----------------------------
+# JSON Helpers
+# -----------------------------
+def json_loads(raw):
+    return orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw)
+
+def json_dumps_pretty(obj):
+    """Serialize to 2-space indented UTF-8 JSON bytes"""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2) if ORJSON_AVAILABLE else json.dumps(obj, indent=2).encode("utf-8")
+
+# -----------------------------
+# Google Sheets Client
+# -----------------------------
+@st.cache_resource(show_spinner=False)
+def authorize_client(sa_json):
+    """Authorized gspread client shared by all sessions; errors propagate so they aren't cached"""
+    creds = Credentials.from_service_account_info(json_loads(sa_json), scopes=SCOPES)
+    client = gspread.authorize(creds)
+    # Handles cached from this client are keyed on it, so a rotated secret opens fresh ones
+    client.auth_key = hashlib.sha256(sa_json.encode()).hexdigest()
+    return client
+
+def get_gsheet_client():
+    if not GOOGLE_SHEETS_AVAILABLE:
+        return None
+    try:
+        if "gcp_service_account" in st.secrets:
+            sa_info = st.secrets["gcp_service_account"]
+            if not isinstance(sa_info, str):
+                sa_info = json.dumps(dict(sa_info), sort_keys=True)
+            return authorize_client(sa_info)
+        else:
+            return None
+    except Exception as e:
+        st.warning(f"Failed to authorize Google Sheets: {e}")
+        return None
+
+@st.cache_resource(show_spinner=False)
+def open_or_create_spreadsheet(_client, name, auth_key):
+    """Open (or create) the named spreadsheet once per client and share the handle across sessions"""
+    # open() already searches Drive by name, so no separate listing of every file first
+    try:
+        return _client.open(name)
+    except gspread.SpreadsheetNotFound:
+        return _client.create(name)
+
+@st.cache_resource(show_spinner=False)
+def get_worksheets(_sh, headers, auth_key):
+    """Worksheet handles keyed by tab name for every tab in headers, creating (with its header row) any that are missing"""
+    # One metadata fetch for all tabs instead of one per sh.worksheet() lookup
+    existing_ws = {ws.title: ws for ws in _sh.worksheets()}
+
+    # Add every missing tab in one batchUpdate and seed all their headers in one values write
+    missing = [name for name in headers if name not in existing_ws]
+    if missing:
+        _sh.batch_update({"requests": [
+            {"addSheet": {"properties": {"title": name, "gridProperties": {"rowCount": 100, "columnCount": 20}}}}
+            for name in missing
+        ]})
+        _sh.values_batch_update(body={
+            "valueInputOption": "RAW",
+            "data": [{"range": f"{name}!A1", "values": [headers[name]]} for name in missing]
+        })
+        existing_ws = {ws.title: ws for ws in _sh.worksheets()}
+
+    return {name: existing_ws[name] for name in headers}
+
+def to_records(value_range, numericise=False):
+    """Turn a header row plus data rows into dicts, like get_all_records(); numericise turns number-like cells into numbers"""
+    rows = value_range.get("values", [])
+    if not rows:
+        return []
+    header = rows[0]
+    padded = (r + [""] * (len(header) - len(r)) for r in rows[1:])
+    if numericise:
+        padded = (gspread.utils.numericise_all(r) for r in padded)
+    return [dict(zip(header, r)) for r in padded]
+
+# -----------------------------
+# Admin Login
+# -----------------------------
+@st.fragment
+def admin_login():
+    """Login form; typing reruns only this fragment, a successful login reruns the whole page"""
+    st.subheader("🔒 Admin Login")
+    username = st.text_input("Username")
+    password = st.text_input("Password", type="password")
+    if st.button("Login"):
+        # Constant-time compares so response timing doesn't leak how much of the input matched
+        user_ok = hmac.compare_digest(username.encode(), b"admin")
+        pass_ok = hmac.compare_digest(password.encode(), b"admin123")
+        if user_ok and pass_ok:
+            st.session_state.admin_logged_in = True
+            st.session_state.just_logged_in = True
+            st.rerun()
+        else:
+            st.error("❌ Incorrect username or password")
 
 def build_vehicle_timeline(vehicle, history):
 
@@ -110,53 +243,40 @@ def build_vehicle_trail(vehicle, history):
 
     return f"{trail_text} | OV/TOTAL:{ov_km}/{total_km}"
 
-def calculate_km_stats(vehicle, history):
-
-    vehicle_km = 0
-    eligible_km = 0
-
-    for record in history:
-
-        km = float(record.get("km", 0))
-
-        players_present = record.get("players_present", [])
-        selected_vehicles = record.get("selected_vehicles", [])
-        excluded = record.get("excluded_vehicle_owners", [])
-
-        if isinstance(players_present, str):
-            players_present = [
-                p.strip()
-                for p in players_present.split(",")
-                if p.strip()
-            ]
-
-        if isinstance(selected_vehicles, str):
-            selected_vehicles = [
-                v.strip()
-                for v in selected_vehicles.split(",")
-                if v.strip()
-            ]
-
-        if isinstance(excluded, str):
-            excluded = [
-                p.strip()
-                for p in excluded.split(",")
-                if p.strip()
-            ]
-
-        if vehicle in players_present and vehicle not in excluded:
-            eligible_km += km
-
-        if vehicle in selected_vehicles:
-            vehicle_km += km
-
-    ratio = (
-        vehicle_km / eligible_km
-        if eligible_km > 0
-        else 0
-    )
-
-    return vehicle_km, eligible_km, ratio
+def split_names(value):
+    """History list fields arrive as lists (this session) or comma-joined strings (from the sheet)"""
+    if isinstance(value, str):
+        return [p.strip() for p in value.split(",") if p.strip()]
+    return value
+
+def km_totals(history):
+    """Vehicle KM, Eligible KM and KM Ratio per owner, aggregated over the history in one pass"""
+    hist = pd.DataFrame({
+        "km": [float(r.get("km", 0)) for r in history],
+        "present": [split_names(r.get("players_present", [])) for r in history],
+        "excluded": [split_names(r.get("excluded_vehicle_owners", [])) for r in history],
+        "selected": [split_names(r.get("selected_vehicles", [])) for r in history]
+    })
+    km = hist["km"].to_numpy()
+
+    def pairs(column):
+        # (match, name) pairs, once per name per match
+        names = hist[column].explode().dropna()
+        return pd.MultiIndex.from_arrays([names.index.to_numpy(dtype=int), names.to_numpy()]).unique()
+
+    def km_by_name(match_names):
+        return pd.Series(
+            km[match_names.get_level_values(0).to_numpy(dtype=int)],
+            index=match_names.get_level_values(1)
+        ).groupby(level=0).sum()
+
+    # Eligible for fairness: present and not excluded; vehicle KM: actually used
+    totals = pd.DataFrame({
+        "Vehicle KM": km_by_name(pairs("selected")),
+        "Eligible KM": km_by_name(pairs("present").difference(pairs("excluded")))
+    }).fillna(0.0)
+    totals["KM Ratio"] = (totals["Vehicle KM"] / totals["Eligible KM"]).where(totals["Eligible KM"] > 0, 0.0)
+    return totals
 
 def update_usage(selected_players, eligible_players, usage):
     for p in selected_players:
@@ -244,54 +364,11 @@ def select_vehicles_auto(vehicle_set, players_today, num_needed, usage, vehicle_
 
     return selected
 """
-def calculate_km_ratio(vehicle, history):
-
-    vehicle_km = 0
-    eligible_km = 0
-
-    for record in history:
-
-        km = float(record.get("km", 0))
-
-        players_present = record.get("players_present", [])
-        selected_vehicles = record.get("selected_vehicles", [])
-        excluded = record.get("excluded_vehicle_owners", [])
+def vehicle_lookup(vehicles):
+    """frozenset of vehicle owners for membership, plus name -> position for tie-breaks"""
+    return frozenset(vehicles), {v: i for i, v in enumerate(vehicles)}
 
-        if isinstance(players_present, str):
-            players_present = [
-                p.strip()
-                for p in players_present.split(",")
-                if p.strip()
-            ]
-
-        if isinstance(selected_vehicles, str):
-            selected_vehicles = [
-                v.strip()
-                for v in selected_vehicles.split(",")
-                if v.strip()
-            ]
-
-        if isinstance(excluded, str):
-            excluded = [
-                p.strip()
-                for p in excluded.split(",")
-                if p.strip()
-            ]
-
-        # Eligible for fairness
-        if vehicle in players_present and vehicle not in excluded:
-            eligible_km += km
-
-        # Vehicle actually used
-        if vehicle in selected_vehicles:
-            vehicle_km += km
-
-    if eligible_km == 0:
-        return 0
-
-    return vehicle_km / eligible_km
-
-def select_vehicles_auto(vehicle_set, players_today, excluded_vehicle_owners, num_needed, usage, vehicle_groups, history):
+def select_vehicles_auto(vehicle_set, vehicle_order, players_today, excluded_vehicle_owners, num_needed, usage, vehicle_groups, history):
     """
     Fairly select vehicles with following logic:
     ✅ Exclude vehicles (and their groups) used in the last match.
@@ -301,7 +378,14 @@ def select_vehicles_auto(vehicle_set, players_today, excluded_vehicle_owners, nu
     import streamlit as st
 
     selected = []
-    eligible = [v for v in players_today if v in vehicle_set and v not in excluded_vehicle_owners]
+    excluded = set(excluded_vehicle_owners)
+    eligible = [v for v in players_today if v in vehicle_set and v not in excluded]
+
+    # Each player's group (first group listing them), so group lookups are one dict hit
+    group_of = {}
+    for members in vehicle_groups.values():
+        for m in members:
+            group_of.setdefault(m, frozenset(members))
 
     # --- Step 1: Collect vehicles used in last match ---
     recently_used = set()
@@ -316,10 +400,7 @@ def select_vehicles_auto(vehicle_set, players_today, excluded_vehicle_owners, nu
         for v in last_selected:
             recently_used.add(v)
             # Include group members of last used vehicle
-            for members in vehicle_groups.values():
-                if v in members:
-                    recently_used.update(members)
-                    break
+            recently_used |= group_of.get(v, frozenset())
 
         st.write("🕓 Recently Used Vehicles (including group members):", recently_used)
 
@@ -345,37 +426,32 @@ def select_vehicles_auto(vehicle_set, players_today, excluded_vehicle_owners, nu
     st.write("✅ Eligible for selection:", filtered_eligible)
 
     # --- Step 4: Selection Loop ---
-    for _ in range(num_needed):
-        if not filtered_eligible:
-            break
-
-        def km_ratio(p):
-            return calculate_km_ratio(p, history)
-
-        def recency_score(p):
-            # Higher = longer ago used (or never used)
-            return last_used_order.get(p, float('inf'))
-
-        # Sort by: 1️⃣ least used, 2️⃣ least recently used, 3️⃣ list order
-        ordered = sorted(
-            filtered_eligible,
-            key=lambda p: (km_ratio(p), -recency_score(p), vehicle_set.index(p))
-        )
-
-        pick = ordered[0]
+    def recency_score(p):
+        # Higher = longer ago used (or never used)
+        return last_used_order.get(p, float('inf'))
+
+    # Ranking keys don't change between picks, so compute them once:
+    # 1️⃣ least used, 2️⃣ least recently used, 3️⃣ list order
+    km_ratio = km_totals(history)["KM Ratio"]
+    heap = [
+        (km_ratio.get(p, 0), -recency_score(p), vehicle_order[p], p)
+        for p in filtered_eligible
+    ]
+    heapq.heapify(heap)
+    removed = set()
+
+    while heap and len(selected) < num_needed:
+        pick = heapq.heappop(heap)[-1]
+        if pick in removed:
+            continue
         selected.append(pick)
         st.write(f"🎯 Selected: {pick}")
 
         # Update usage tracking
         #update_usage([pick], eligible, usage)
 
-        # Remove picked vehicle + all in same group
-        for members in vehicle_groups.values():
-            if pick in members:
-                filtered_eligible = [e for e in filtered_eligible if e not in members]
-                break
-        else:
-            filtered_eligible.remove(pick)
+        # Remove picked vehicle + all in same group (skipped lazily when popped)
+        removed |= group_of.get(pick, {pick})
 
     # --- Step 5: Return Final Selection ---
     st.write("🚗 Final selected vehicles:", selected)
@@ -391,9 +467,272 @@ def generate_message(game_date, ground_name, players, selected):
     )
     return message
 
+def history_row(r):
+    """A match record as a History sheet row, with list fields joined by ', '"""
+    def joined(v):
+        return ", ".join(v) if isinstance(v, list) else v
+    return [
+        r["date"],
+        r["ground"],
+        r.get("km", 0),
+        joined(r["players_present"]),
+        joined(r.get("excluded_vehicle_owners", "")),
+        joined(r["selected_vehicles"]),
+        r["message"]
+    ]
+
+
+def sheet_rows(name, data):
+    """Header plus data rows for one sheet, as written by the save buttons"""
+    if name == "Players":
+        rows = [[p] for p in sorted(data)]
+    elif name == "VehicleGroups":
+        rows = [[k, ", ".join(v)] for k, v in data.items()]
+    elif name == "Grounds":
+        rows = [[g["Ground"], g["KM"]] for g in data]
+    elif name == "History":
+        rows = [history_row(r) for r in data]
+    else:
+        rows = [[x] for x in data]
+    return [SHEET_HEADERS[name]] + rows
+
+# -----------------------------
+# Pending Writes
+# -----------------------------
+def retry_on_quota(fn):
+    """Retry 429 (quota) and 503 (backend unavailable) errors with jittered exponential backoff; re-raise after 5 attempts"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(5):
+            try:
+                return fn(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                if getattr(e.response, "status_code", 0) not in (429, 503) or attempt == 4:
+                    raise
+                time.sleep(random.uniform(1, min(32, 2 ** attempt)))
+    return wrapper
+
+@retry_on_quota
+def append_rows(ws, rows):
+    return ws.append_rows(rows, value_input_option="RAW")
+
+@retry_on_quota
+def rewrite_ws(ws, rows):
+    """Clear a worksheet and write rows, header first"""
+    ws.clear()
+    return ws.append_rows(rows, value_input_option="RAW")
+
+@retry_on_quota
+def delete_rows(ws, start, end):
+    return ws.delete_rows(start, end)
+
+@retry_on_quota
+def batch_rewrite(sh, clear_ranges, data):
+    """Clear ranges on any tabs, then write blocks of rows: one batch clear plus one batch update"""
+    sh.values_batch_clear(body={"ranges": clear_ranges})
+    return sh.values_batch_update(body={"valueInputOption": "RAW", "data": data})
+
+def mark_pending(name):
+    """Record that a sheet has in-memory changes not yet saved to Google Sheets"""
+    st.session_state.pending_writes.add(name)
+
+def flush_pending_writes(sh, data, sheet_ranges=SHEET_RANGES, rows_for=sheet_rows):
+    """Rewrite every pending sheet with one batch clear and one batch update; the caller clears its read caches"""
+    pending = [n for n in sheet_ranges if n in st.session_state.pending_writes]
+    if not pending:
+        return
+    rows = {n: rows_for(n, data[n]) for n in pending}
+    batch_rewrite(
+        sh,
+        [sheet_ranges[n] for n in pending],
+        [{"range": f"{n}!A1", "values": rows[n]} for n in pending]
+    )
+    if "History" in rows:
+        st.session_state.history_synced = rows["History"][1:]
+    st.session_state.pending_writes.clear()
+
+def restore_backup(upload_file, players, vehicles, vehicle_groups, history, history_df, rows_for=history_row):
+    """Load an uploaded backup into the session's data in place and mark it pending, once per uploaded file"""
+    # The uploader keeps its file across reruns, so re-applying it would undo every later edit
+    if st.session_state.get("restored_upload") == upload_file.file_id:
+        return
+    st.session_state.restored_upload = upload_file.file_id
+    data = json_loads(upload_file.getvalue())
+    players[:] = [p["Player"] for p in data.get("Players", [])]
+    vehicles[:] = [v["Vehicle"] for v in data.get("Vehicles", [])]
+    vehicle_groups.clear()
+    vehicle_groups.update({g["Vehicle"]: g["Players"].split(", ") for g in data.get("VehicleGroups", [])})
+    history[:] = data.get("History", [])
+    history_df.drop(history_df.index, inplace=True)
+    for r in history:
+        history_df.loc[len(history_df)] = rows_for(r)
+    for name in ("Players", "Vehicles", "VehicleGroups", "History"):
+        mark_pending(name)
+
+@st.cache_data(show_spinner=False)
+def build_backup_json(players, vehicles, vehicle_groups, history):
+    """Backup JSON for the download button, re-serialized only when the data changes"""
+    backup_data = {
+        "Players":[{"Player":p} for p in players],
+        "Vehicles":[{"Vehicle":v} for v in vehicles],
+        "VehicleGroups":[{"Vehicle":k,"Players":", ".join(v)} for k,v in vehicle_groups.items()],
+        "History":history
+    }
+    return json_dumps_pretty(backup_data)
+
+@st.cache_data(show_spinner=False)
+def build_history_csv(history_df):
+    """Encoded CSV download for the match history, re-encoded only when its rows change"""
+    buf = io.BytesIO()
+    history_df.to_csv(buf, index=False, encoding="utf-8")
+    return buf.getvalue()
+
+@st.cache_data(show_spinner=False)
+def build_km_table(vehicles, history):
+    """KM fairness table ranked by ratio; cached on the owners and history contents"""
+    totals = km_totals(history).reindex(sorted(vehicles), fill_value=0.0)
+
+    df_km = pd.DataFrame({
+        "Vehicle Owner": totals.index,
+        "Vehicle KM": totals["Vehicle KM"].to_numpy(),
+        "Eligible KM": totals["Eligible KM"].to_numpy(),
+        "KM Ratio": [round(r, 3) for r in totals["KM Ratio"]]
+    })
+
+    df_km = df_km.sort_values(
+        "KM Ratio",
+        ascending=True
+    ).reset_index(drop=True)
+
+    df_km.index += 1
+    df_km.index.name = "Rank"
+
+    return df_km
+
+@st.fragment
+def daily_match_selection(players, vehicles, vehicle_groups, history, history_df, usage, grounds, client, ws_history, clear_sheet_cache):
+    """Match selection widgets; reruns on its own so picking players doesn't redraw the whole page"""
+    st.header("3️⃣ Daily Match Selection")
+    with st.expander("⚙️ Manage Match Selection (Admin Access Required)", expanded=False):
+
+        admin_disabled = not st.session_state.admin_logged_in
+
+        game_date = st.date_input("Select date:", value=datetime.date.today(),disabled=admin_disabled)
+        #ground_name = st.text_input("Ground name:",disabled=admin_disabled)
+        ground_options = sorted(
+            [g["Ground"] for g in grounds if g.get("Ground")]
+        )
+
+        ground_name = st.selectbox(
+            "Select Ground:",
+            ground_options,
+            disabled=admin_disabled
+        )
+
+        selected_ground_km = 0
+
+        st.write("Grounds:", grounds)
+        for g in grounds:
+            if g.get("Ground") == ground_name:
+                selected_ground_km = int(g.get("KM", 0))
+                break
+    
+        st.info(f"📍 Distance: {selected_ground_km} km")
+
+        players_today = st.multiselect("Select players present today:", sorted(players),disabled=admin_disabled)
+        vehicle_set, vehicle_order = vehicle_lookup(vehicles)
+        num_needed = st.number_input("Number of vehicles needed:", 1, len(vehicles) if vehicles else 1, 1, disabled=admin_disabled)
+
+        excluded_vehicle_owners = st.multiselect(
+            "Vehicle owners not available for selection today (optional)",
+            [p for p in players_today if p in vehicle_set],
+            disabled=admin_disabled,
+            help="Use when a vehicle owner is present but should not be considered for vehicle fairness (e.g. came separately, vehicle unavailable, etc.)"
+        )
+
+        selection_mode = st.radio("Vehicle Selection Mode:", ["Auto-Select", "Manual-Select"], key="mode",disabled=admin_disabled)
+        
+        if selection_mode == "Manual-Select":
+            manual_selected = st.multiselect("Select vehicles manually:", sorted(vehicles), default=[],disabled=admin_disabled)
+        else:
+            manual_selected = []
+
+        if st.button("Select Vehicles",disabled=admin_disabled):
+            if not ground_name:
+                st.error("❌ Please select a ground.")
+                st.stop()
+
+            if selected_ground_km <= 0:
+                st.error(f"❌ Ground '{ground_name}' does not have a valid KM configured.")
+                st.stop()
+
+            eligible = [v for v in players_today if v in vehicle_set]
+            if selection_mode=="Auto-Select":
+                selected = select_vehicles_auto(vehicle_set, vehicle_order, players_today, excluded_vehicle_owners, num_needed, usage, vehicle_groups, history)
+                update_usage(selected, eligible, usage)
+            else:
+                if len(manual_selected) != num_needed:
+                    st.warning(f"⚠️ Select exactly {num_needed} vehicles")
+                    selected = []
+                else:
+                    selected = manual_selected
+                    update_usage(selected, eligible, usage)
+            if selected:
+                msg = generate_message(game_date, ground_name, players_today, selected)
+                # Store in memory
+                history.append({
+                    "date": str(game_date),
+                    "ground": ground_name,
+                    "km": selected_ground_km,
+                    "players_present": players_today,
+                    "excluded_vehicle_owners": excluded_vehicle_owners,
+                    "selected_vehicles": selected,
+                    "message": msg
+                })
+                history_df.loc[len(history_df)] = history_row(history[-1])
+                mark_pending("History")
+                # History feeds the sections below the fragment, so rerun the whole page
+                st.session_state.last_selection = (msg, selected)
+                st.rerun()
+
+        if "last_selection" in st.session_state:
+            msg, selected = st.session_state.pop("last_selection")
+            st.subheader("📋 Copy-Ready Message")
+            #st.text_area("Message:", msg, height=200)
+            st.code(msg, language=None)
+            st.success(f"✅ Vehicles selected: {', '.join(selected)}")
+
+        if st.button("💾 Save Match History to Google Sheet", disabled=admin_disabled) and client:
+            try:
+                rows = [history_row(r) for r in history]
+                synced = st.session_state.history_synced
+                n = 0
+                while n < min(len(rows), len(synced)) and rows[n] == synced[n]:
+                    n += 1
+                if n == len(synced):
+                    # Only new matches since the last save: append them
+                    if rows[n:]:
+                        append_rows(ws_history, rows[n:])
+                elif n == len(rows):
+                    # Entries were undone: drop the trailing rows (row 1 is the header)
+                    delete_rows(ws_history, n + 2, len(synced) + 1)
+                else:
+                    rewrite_ws(ws_history, [HISTORY_HEADERS] + rows)
+                st.session_state.history_synced = rows
+                st.session_state.pending_writes.discard("History")
+                clear_sheet_cache()
+        
+                st.success("✅ Match history saved to Google Sheet")
+        
+            except Exception as e:
+                if "quota" in str(e).lower() or "rate limit" in str(e).lower():
+                    st.error("⚠️ Google Sheets quota exceeded. Please try again after a few minutes.")
+                else:
+                    st.error(f"❌ Failed to save match history: {e}")
+
 
-def vehicle_management(players, vehicles, vehicle_groups, history, usage, grounds, client,
-                           ws_players, ws_vehicles, ws_groups, ws_history, ws_grounds):
+def vehicle_management(players, vehicles, vehicle_groups, history, history_df, usage, grounds, client,
+                           ws_players, ws_vehicles, ws_groups, ws_history, ws_grounds, clear_sheet_cache):
     
     if st.session_state.admin_logged_in and client:
         st.sidebar.subheader("⚙️ Admin Controls - Vehicle Management")
@@ -401,18 +740,10 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
         if "backup_downloaded" not in st.session_state:
             st.session_state.backup_downloaded = False
 
-        # Prepare backup data
-        backup_data = {
-            "Players":[{"Player":p} for p in players],
-            "Vehicles":[{"Vehicle":v} for v in vehicles],
-            "VehicleGroups":[{"Vehicle":k,"Players":", ".join(v)} for k,v in vehicle_groups.items()],
-            "History":history
-        }
-
         # Download backup button
         if st.sidebar.download_button(
             "📥 Download Backup",
-            json.dumps(backup_data, indent=4),
+            build_backup_json(tuple(players), tuple(vehicles), vehicle_groups, history),
             file_name=f"backup_before_reset_{datetime.date.today()}.json",
             mime="application/json"
         ):
@@ -423,17 +754,20 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
         reset_disabled = not st.session_state.backup_downloaded
         if st.sidebar.button("🧹 Reset All (Backup Mandatory)", disabled=reset_disabled):
             try:
-                # Clear in-memory data
-                players, vehicles, vehicle_groups, history, usage = [], [], {}, [], {}
-                # Clear Google Sheets
-                ws_players.clear()
-                ws_players.append_row(["Player"])
-                ws_vehicles.clear()
-                ws_vehicles.append_row(["Vehicle"])
-                ws_groups.clear()
-                ws_groups.append_row(["Vehicle","Players"])
-                ws_history.clear()
-                ws_history.append_row(["date","ground","km","players_present","excluded_vehicle_owners","selected_vehicles","message"])
+                # Clear in-memory data (in place, so the session's copies are cleared too)
+                for data in (players, vehicles, vehicle_groups, history, usage):
+                    data.clear()
+                history_df.drop(history_df.index, inplace=True)
+                # Clear Google Sheets: one batch clear plus one batch header write
+                reset_sheets = ["Players", "Vehicles", "VehicleGroups", "History"]
+                batch_rewrite(
+                    ws_players.spreadsheet,
+                    [f"{n}!A:Z" for n in reset_sheets],
+                    [{"range": f"{n}!A1", "values": [SHEET_HEADERS[n]]} for n in reset_sheets]
+                )
+                st.session_state.history_synced = []
+                st.session_state.pending_writes -= set(reset_sheets)
+                clear_sheet_cache()
                 st.sidebar.success("✅ All data reset")
                 # Reset backup flag
                 st.session_state.backup_downloaded = False
@@ -447,17 +781,31 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
         if st.sidebar.button("↩ Undo Last Entry"):
             if history:
                 history.pop()
+                history_df.drop(history_df.index[-1], inplace=True)
+                mark_pending("History")
                 st.sidebar.success("✅ Last entry removed from memory, save history to google sheet in section 4")
 
         # Upload
         upload_file = st.sidebar.file_uploader("Upload Backup JSON", type="json")
         if upload_file:
-            data = json.load(upload_file)
-            players = [p["Player"] for p in data.get("Players",[])]
-            vehicles = [v["Vehicle"] for v in data.get("Vehicles",[])]
-            vehicle_groups = {g["Vehicle"]: g["Players"].split(", ") for g in data.get("VehicleGroups",[])}
-            history = data.get("History",[])
-            st.sidebar.success("✅ Data restored from backup, press respective save buttons to save in google sheet")
+            restore_backup(upload_file, players, vehicles, vehicle_groups, history, history_df)
+            st.sidebar.success("✅ Data restored from backup, press 💾 Save All Pending Changes (or the respective save buttons) to save in google sheet")
+
+        # Save everything changed since the last save in one go
+        pending_badge = st.sidebar.empty()
+        if st.sidebar.button("💾 Save All Pending Changes"):
+            try:
+                flush_pending_writes(ws_players.spreadsheet, {
+                    "Players": players, "Vehicles": vehicles, "VehicleGroups": vehicle_groups,
+                    "Grounds": grounds, "History": history
+                })
+                clear_sheet_cache()
+                st.sidebar.success("✅ Pending changes saved to Google Sheet")
+            except Exception as e:
+                if "quota" in str(e).lower() or "rate limit" in str(e).lower():
+                    st.sidebar.error("⚠️ Google Sheets quota exceeded. Please try again after a few minutes.")
+                else:
+                    st.sidebar.error(f"❌ Failed to save pending changes: {e}")
 
     st.header("Ground Management")
 
@@ -497,6 +845,7 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
                     "Ground": new_ground.strip(),
                     "KM": ground_km
                 })
+                mark_pending("Grounds")
                 st.success(f"✅ Added ground: {new_ground}")
 
         if grounds:
@@ -514,19 +863,10 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
 
             try:
 
-                ws_grounds.clear()
+                rewrite_ws(ws_grounds, sheet_rows("Grounds", grounds))
 
-                ws_grounds.append_row([
-                    "Ground",
-                    "KM"
-                ])
-
-                for g in grounds:
-
-                    ws_grounds.append_row([
-                        g["Ground"],
-                        g["KM"]
-                    ])
+                st.session_state.pending_writes.discard("Grounds")
+                clear_sheet_cache()
 
                 st.success(
                     "✅ Grounds saved to Google Sheet"
@@ -554,6 +894,7 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
         if st.button("Add Vehicle",disabled=admin_disabled):
             if new_vehicle in players and new_vehicle not in vehicles:
                 vehicles.append(new_vehicle)
+                mark_pending("Vehicles")
                 st.success(f"✅ Added vehicle owner: {new_vehicle}")
             else:
                 st.warning("⚠️ Vehicle owner must exist in players and not duplicate")
@@ -561,13 +902,13 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
             remove_vehicle_name = st.selectbox("Remove vehicle owner:", ["None"]+vehicles, disabled=admin_disabled)
             if remove_vehicle_name!="None" and st.button("Remove Vehicle",disabled=admin_disabled):
                 vehicles.remove(remove_vehicle_name)
+                mark_pending("Vehicles")
                 st.success(f"🗑️ Removed vehicle: {remove_vehicle_name}")
         if st.button("💾 Save Vehicles to Google Sheet",disabled=admin_disabled) and client:
             try:
-                ws_vehicles.clear()
-                ws_vehicles.append_row(["Vehicle"])
-                for v in vehicles:
-                    ws_vehicles.append_row([v])
+                rewrite_ws(ws_vehicles, sheet_rows("Vehicles", vehicles))
+                st.session_state.pending_writes.discard("Vehicles")
+                clear_sheet_cache()
                 st.success("✅ Vehicles saved to Google Sheet")
             except Exception as e:
                 if "quota" in str(e).lower() or "rate limit" in str(e).lower():
@@ -589,13 +930,13 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
         if st.button("Add/Update Vehicle Group",disabled=admin_disabled):
             if vg_vehicle:
                 vehicle_groups[vg_vehicle] = vg_members
+                mark_pending("VehicleGroups")
                 st.success(f"✅ Group updated for {vg_vehicle}")
         if st.button("💾 Save Vehicle Groups to Google Sheet",disabled=admin_disabled) and client:
             try:
-                ws_groups.clear()
-                ws_groups.append_row(["Vehicle","Players"])
-                for k,v in vehicle_groups.items():
-                    ws_groups.append_row([k, ", ".join(v)])
+                rewrite_ws(ws_groups, sheet_rows("VehicleGroups", vehicle_groups))
+                st.session_state.pending_writes.discard("VehicleGroups")
+                clear_sheet_cache()
                 st.success("✅ Vehicle groups saved to Google Sheet")
             except Exception as e:
                 if "quota" in str(e).lower() or "rate limit" in str(e).lower():
@@ -613,116 +954,7 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
     # -----------------------------
     # Daily Match Selection
     # -----------------------------
-    st.header("3️⃣ Daily Match Selection")
-    with st.expander("⚙️ Manage Match Selection (Admin Access Required)", expanded=False):
-
-        admin_disabled = not st.session_state.admin_logged_in
-
-        game_date = st.date_input("Select date:", value=datetime.date.today(),disabled=admin_disabled)
-        #ground_name = st.text_input("Ground name:",disabled=admin_disabled)
-        ground_options = sorted(
-            [g["Ground"] for g in grounds if g.get("Ground")]
-        )
-
-        ground_name = st.selectbox(
-            "Select Ground:",
-            ground_options,
-            disabled=admin_disabled
-        )
-
-        selected_ground_km = 0
-
-        st.write("Grounds:", grounds)
-        for g in grounds:
-            if g.get("Ground") == ground_name:
-                selected_ground_km = int(g.get("KM", 0))
-                break
-    
-        st.info(f"📍 Distance: {selected_ground_km} km")
-
-        players_today = st.multiselect("Select players present today:", sorted(players),disabled=admin_disabled)
-        num_needed = st.number_input("Number of vehicles needed:", 1, len(vehicles) if vehicles else 1, 1, disabled=admin_disabled)
-
-        excluded_vehicle_owners = st.multiselect(
-            "Vehicle owners not available for selection today (optional)",
-            [p for p in players_today if p in vehicles],
-            disabled=admin_disabled,
-            help="Use when a vehicle owner is present but should not be considered for vehicle fairness (e.g. came separately, vehicle unavailable, etc.)"
-        )
-
-        selection_mode = st.radio("Vehicle Selection Mode:", ["Auto-Select", "Manual-Select"], key="mode",disabled=admin_disabled)
-        
-        if selection_mode == "Manual-Select":
-            manual_selected = st.multiselect("Select vehicles manually:", sorted(vehicles), default=[],disabled=admin_disabled)
-        else:
-            manual_selected = []
-
-        if st.button("Select Vehicles",disabled=admin_disabled):
-            if not ground_name:
-                st.error("❌ Please select a ground.")
-                st.stop()
-
-            if selected_ground_km <= 0:
-                st.error(f"❌ Ground '{ground_name}' does not have a valid KM configured.")
-                st.stop()
-
-            eligible = [v for v in players_today if v in vehicles]
-            if selection_mode=="Auto-Select":
-                selected = select_vehicles_auto(vehicles, players_today, excluded_vehicle_owners, num_needed, usage, vehicle_groups, history)
-                update_usage(selected, eligible, usage)
-            else:
-                if len(manual_selected) != num_needed:
-                    st.warning(f"⚠️ Select exactly {num_needed} vehicles")
-                    selected = []
-                else:
-                    selected = manual_selected
-                    update_usage(selected, eligible, usage)
-            if selected:
-                msg = generate_message(game_date, ground_name, players_today, selected)
-                st.subheader("📋 Copy-Ready Message")
-                #st.text_area("Message:", msg, height=200)
-                st.code(msg, language=None)
-                # Store in memory
-                history.append({
-                    "date": str(game_date),
-                    "ground": ground_name,
-                    "km": selected_ground_km,
-                    "players_present": players_today,
-                    "excluded_vehicle_owners": excluded_vehicle_owners,
-                    "selected_vehicles": selected,
-                    "message": msg
-                })
-                st.success(f"✅ Vehicles selected: {', '.join(selected)}")
-
-        if st.button("💾 Save Match History to Google Sheet", disabled=admin_disabled) and client:
-            try:
-                data = [["date","ground","km","players_present","excluded_vehicle_owners","selected_vehicles","message"]]
-        
-                for r in history:
-                    players_str = ", ".join(r["players_present"]) if isinstance(r["players_present"], list) else r["players_present"]
-                    vehicles_str = ", ".join(r["selected_vehicles"]) if isinstance(r["selected_vehicles"], list) else r["selected_vehicles"]
-                    excluded_str = ", ".join(r.get("excluded_vehicle_owners", [])
-)        
-                    data.append([
-                        r["date"],
-                        r["ground"],
-                        r.get("km", 0),
-                        players_str,
-                        excluded_str,
-                        vehicles_str,
-                        r["message"]
-                    ])
-        
-                ws_history.clear()
-                ws_history.update("A1", data)   # ← SINGLE API CALL
-        
-                st.success("✅ Match history saved to Google Sheet")
-        
-            except Exception as e:
-                if "quota" in str(e).lower() or "rate limit" in str(e).lower():
-                    st.error("⚠️ Google Sheets quota exceeded. Please try again after a few minutes.")
-                else:
-                    st.error(f"❌ Failed to save match history: {e}")
+    daily_match_selection(players, vehicles, vehicle_groups, history, history_df, usage, grounds, client, ws_history, clear_sheet_cache)
 
     # -----------------------------
     # Vehicle Usage Table & Chart
@@ -746,33 +978,7 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
 
     if history:
 
-        km_rows = []
-
-        for vehicle in sorted(vehicles):
-
-            vehicle_km, eligible_km, ratio = calculate_km_stats(
-                vehicle,
-                history
-            )
-
-            km_rows.append({
-                "Vehicle Owner": vehicle,
-                "Vehicle KM": vehicle_km,
-                "Eligible KM": eligible_km,
-                "KM Ratio": round(ratio, 3)
-            })
-
-        df_km = pd.DataFrame(km_rows)
-
-        df_km = df_km.sort_values(
-            "KM Ratio",
-            ascending=True
-        ).reset_index(drop=True)
-
-        df_km.index += 1
-        df_km.index.name = "Rank"
-
-        st.table(df_km)
+        st.table(build_km_table(tuple(vehicles), history))
 
     else:
         st.info("No KM history yet")
@@ -783,27 +989,18 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
     # Recent Match Records
     # -----------------------------
     st.header("5️⃣ Recent Vehicle Records")
-    if history:
-        for r in reversed(history[-10:]):
-            vehicles_value = r["selected_vehicles"]
-            if isinstance(vehicles_value, list):
-                display_vehicles = ", ".join(vehicles_value)
-            else:
-                display_vehicles = vehicles_value
-            st.write(f"📅 {r['date']} — {r['ground']} ({r.get('km',0)} km) — 🚗 {display_vehicles}")
+    if not history_df.empty:
+        for r in history_df.tail(10).iloc[::-1].itertuples(index=False):
+            st.write(f"📅 {r.date} — {r.ground} ({r.km} km) — 🚗 {r.selected_vehicles}")
             #st.write(f"📅 {r['date']} — {r['ground']} — 🚗 {display_vehicles}")
     else:
         st.info("No match records yet")
     
-    if history:
+    if not history_df.empty:
         st.header("6️⃣ Download Vehicle History")
-        df_history = pd.DataFrame(history)  # columns: date, ground, players_present, selected_vehicles, message
-        import io
-        csv_buffer = io.StringIO()
-        df_history.to_csv(csv_buffer, index=False)
         st.download_button(
             "📥 Download History as CSV",
-            data=csv_buffer.getvalue(),
+            data=build_history_csv(history_df),
             file_name="match_history.csv",
             mime="text/csv"
         )
@@ -828,6 +1025,13 @@ def vehicle_management(players, vehicles, vehicle_groups, history, usage, ground
     else:
         st.info("No history available")
 
+    # Pending-changes badge, filled last so it counts this run's edits
+    if st.session_state.admin_logged_in and client:
+        if st.session_state.pending_writes:
+            pending_badge.info(f"🕒 Unsaved changes: {', '.join(sorted(st.session_state.pending_writes))}")
+        else:
+            pending_badge.caption("✅ All changes saved")
+
 #    st.header("8️⃣ Vehicle Fairness Timeline")
 #    if history:
 #